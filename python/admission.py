@@ -0,0 +1,167 @@
+import os, json, time, logging
+import redis
+from celery_app import app, BROKER_URL
+from redis_client import get_redis as _get_redis
+import fair_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Admission control for /api/process-doc: new uploads are checked against the Celery queue depth
+# and the number of pages accepted but not yet finished. Over the limits an upload is either
+# rejected with a Retry-After estimate or parked in a deferred lane that drains as work completes.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "false").lower() == "true"
+ADMISSION_REDIS_URL = os.environ.get("ADMISSION_REDIS_URL", BROKER_URL)
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", "500"))
+ADMISSION_MAX_BACKLOG_PAGES = int(os.environ.get("ADMISSION_MAX_BACKLOG_PAGES", "5000"))
+ADMISSION_OVERFLOW = os.environ.get("ADMISSION_OVERFLOW", "reject").lower()  # "reject" or "defer"
+ADMISSION_MAX_DEFERRED = int(os.environ.get("ADMISSION_MAX_DEFERRED", "1000"))
+# Cluster throughput used to turn excess backlog into a Retry-After estimate
+ADMISSION_PAGES_PER_MINUTE = float(os.environ.get("ADMISSION_PAGES_PER_MINUTE", "60"))
+# Pages of an upload not finished within this many seconds (lost task, flushed broker,
+# revoked job) leave the backlog; it should exceed the longest real upload
+ADMISSION_TRACK_TTL = int(os.environ.get("ADMISSION_TRACK_TTL", "10800"))
+CELERY_QUEUES = [q for q in os.environ.get("ADMISSION_QUEUES", "celery,cpu,io").split(",") if q]
+
+BACKLOG_KEY = "admission:backlog_pages"
+PAGES_KEY = "admission:pages"  # hash file_hash -> pages counted in the backlog
+TRACKED_KEY = "admission:tracked"  # zset file_hash -> time it entered the backlog
+DEFERRED_KEY = "admission:deferred"
+REJECTED_KEY = "admission:rejected"
+
+
+def get_redis():
+    return _get_redis(ADMISSION_REDIS_URL)
+
+
+def queue_depths():
+    """Messages waiting in each Celery queue on the broker"""
+    broker = _get_redis(BROKER_URL)
+    return {queue: broker.llen(queue) for queue in CELERY_QUEUES}
+
+
+def backlog_pages():
+    r = get_redis()
+    _expire_stale(r)
+    return max(0, int(r.get(BACKLOG_KEY) or 0))
+
+
+def _untrack(r, file_hash):
+    pages = r.hget(PAGES_KEY, file_hash)
+    if pages is not None and r.hdel(PAGES_KEY, file_hash):  # only one caller gets to decrement
+        r.decrby(BACKLOG_KEY, int(pages))
+    r.zrem(TRACKED_KEY, file_hash)
+
+
+def _expire_stale(r):
+    """Drop uploads whose finish() never came, so they cannot hold the backlog up forever"""
+    stale = r.zrangebyscore(TRACKED_KEY, 0, time.time() - ADMISSION_TRACK_TTL)
+    for file_hash in stale:
+        _untrack(r, file_hash)
+    if stale:
+        logger.warning(f"⚠️ Expired {len(stale)} unfinished uploads from the admission backlog")
+
+
+def retry_after(excess_pages):
+    """Seconds until roughly `excess_pages` pages of backlog have been worked off"""
+    seconds = 60.0 * max(excess_pages, 1) / max(ADMISSION_PAGES_PER_MINUTE, 0.1)
+    return int(min(max(seconds, 5), 3600))
+
+
+def _over_limits(pages):
+    depth = sum(queue_depths().values())
+    backlog = backlog_pages()
+    if depth >= ADMISSION_MAX_QUEUE_DEPTH:
+        return True, backlog
+    if backlog + pages > ADMISSION_MAX_BACKLOG_PAGES and backlog > 0:
+        return True, backlog + pages - ADMISSION_MAX_BACKLOG_PAGES
+    return False, 0
+
+
+def admit(pages):
+    """
+    Decide what to do with a new upload of `pages` pages.
+    Returns ("accept" | "defer" | "reject", retry_after seconds or None).
+    """
+    drain()
+    over, excess = _over_limits(pages)
+    if not over:
+        return "accept", None
+    if ADMISSION_OVERFLOW == "defer" and get_redis().llen(DEFERRED_KEY) < ADMISSION_MAX_DEFERRED:
+        return "defer", None
+    get_redis().incr(REJECTED_KEY)
+    return "reject", retry_after(excess)
+
+
+def track(file_hash, pages):
+    """Count an accepted upload's pages in the backlog until finish() is called for it"""
+    r = get_redis()
+    if r.hsetnx(PAGES_KEY, file_hash, pages):
+        r.incrby(BACKLOG_KEY, pages)
+        r.zadd(TRACKED_KEY, {file_hash: time.time()})
+
+
+def enqueue(tenant, task_id, file_hash, filename, pages):
+    """Hand an admitted upload to the fair scheduler, or straight to Celery"""
+    track(file_hash, pages)
+    if fair_scheduler.FAIR_SCHEDULER_ENABLED:
+        fair_scheduler.submit(tenant, task_id, file_hash, filename, pages)
+        fair_scheduler.dispatch()
+    else:
+        app.send_task("process_document", args=[file_hash, filename], task_id=task_id)
+
+
+def defer(tenant, task_id, file_hash, filename, pages):
+    get_redis().rpush(DEFERRED_KEY, json.dumps({
+        "tenant": tenant, "task_id": task_id, "file_hash": file_hash, "filename": filename,
+        "pages": pages, "deferred_at": time.time(),
+    }))
+
+
+def drain():
+    """Move deferred uploads into the pipeline while the limits allow"""
+    r = get_redis()
+    moved = 0
+    while True:
+        payload = r.lindex(DEFERRED_KEY, 0)
+        if payload is None:
+            break
+        job = json.loads(payload)
+        if _over_limits(job["pages"])[0]:
+            break
+        if r.lrem(DEFERRED_KEY, 1, payload):  # another process may have taken it first
+            enqueue(job["tenant"], job["task_id"], job["file_hash"], job["filename"], job["pages"])
+            logger.info(f"⏳ Released deferred {job['filename']} after {time.time() - job['deferred_at']:.0f}s")
+            moved += 1
+    return moved
+
+
+def finish(file_hash):
+    """Remove a finished (or failed) upload from the backlog and let deferred uploads in; never raises"""
+    if not ADMISSION_ENABLED:
+        return
+    try:
+        _untrack(get_redis(), file_hash)
+        drain()
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Admission state unavailable while finishing {file_hash}: {e}")
+
+
+def admission_metrics():
+    """Queue depth and backlog figures for autoscaling"""
+    r = get_redis()
+    depths = queue_depths()
+    backlog = backlog_pages()
+    return {
+        "queue_depth": depths,
+        "queue_depth_total": sum(depths.values()),
+        "backlog_pages": backlog,
+        "backlog_uploads": r.hlen(PAGES_KEY),
+        "deferred_uploads": r.llen(DEFERRED_KEY),
+        "rejected_total": int(r.get(REJECTED_KEY) or 0),
+        "est_drain_seconds": int(60.0 * backlog / max(ADMISSION_PAGES_PER_MINUTE, 0.1)),
+        "limits": {
+            "max_queue_depth": ADMISSION_MAX_QUEUE_DEPTH,
+            "max_backlog_pages": ADMISSION_MAX_BACKLOG_PAGES,
+            "overflow": ADMISSION_OVERFLOW,
+        },
+    }
@@ -0,0 +1,52 @@
+"""Add binary embedding column to extracted_docs
+
+Revision ID: 3c9e5d21f7a4
+Revises: b52e19c7a0d8
+Create Date: 2026-10-18 15:42:09.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e5d21f7a4'
+down_revision: Union[str, Sequence[str], None] = 'b52e19c7a0d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('extracted_docs', sa.Column('embedding_bin', sa.LargeBinary(), nullable=True))
+    # Packed floats don't compress; keep them out of line without pglz attempts on every write
+    op.execute("ALTER TABLE extracted_docs ALTER COLUMN embedding_bin SET STORAGE EXTERNAL")
+    # Existing JSONB embeddings are converted by backfill_embeddings.py in streaming chunks
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    from embedding_codec import decode
+
+    # Rows written or backfilled since the upgrade only have the binary copy; restore their JSONB first
+    bind = op.get_bind()
+    docs = sa.table('extracted_docs', sa.column('id', sa.Integer), sa.column('embedding', JSONB),
+                    sa.column('embedding_bin', sa.LargeBinary))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(docs.c.id, docs.c.embedding_bin)
+            .where(docs.c.id > last_id, docs.c.embedding_bin.isnot(None), docs.c.embedding.is_(None))
+            .order_by(docs.c.id).limit(1000)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            docs.update().where(docs.c.id == sa.bindparam('doc_id')).values(embedding=sa.bindparam('vector')),
+            [{'doc_id': row.id, 'vector': decode(row.embedding_bin).tolist()} for row in rows],
+        )
+        last_id = rows[-1].id
+    op.drop_column('extracted_docs', 'embedding_bin')
@@ -0,0 +1,30 @@
+"""Unique extracted page checkpoints
+
+Revision ID: 7d3f0a91c2b4
+Revises: 40645b281a76
+Create Date: 2026-10-18 10:12:40.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d3f0a91c2b4'
+down_revision: Union[str, Sequence[str], None] = '40645b281a76'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_unique_constraint(
+        'uq_extracted_pages_upload_page', 'extracted_pages', ['upload_id', 'page_no']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_extracted_pages_upload_page', 'extracted_pages', type_='unique')
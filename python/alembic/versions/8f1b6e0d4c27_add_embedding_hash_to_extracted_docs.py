@@ -0,0 +1,28 @@
+"""Add embedding_hash to extracted_docs
+
+Revision ID: 8f1b6e0d4c27
+Revises: 3c9e5d21f7a4
+Create Date: 2026-10-18 17:20:44.105932
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f1b6e0d4c27'
+down_revision: Union[str, Sequence[str], None] = '3c9e5d21f7a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('extracted_docs', sa.Column('embedding_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('extracted_docs', 'embedding_hash')
@@ -0,0 +1,30 @@
+"""Add page_no to extracted_docs
+
+Revision ID: b52e19c7a0d8
+Revises: 7d3f0a91c2b4
+Create Date: 2026-10-18 11:03:17.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52e19c7a0d8'
+down_revision: Union[str, Sequence[str], None] = '7d3f0a91c2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('extracted_docs', sa.Column('page_no', sa.Integer(), nullable=True))
+    op.create_index('ix_extracted_docs_upload_page', 'extracted_docs', ['upload_id', 'page_no'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_extracted_docs_upload_page', table_name='extracted_docs')
+    op.drop_column('extracted_docs', 'page_no')
@@ -0,0 +1,142 @@
+import os, time, logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Approximate nearest-neighbour structures over an embedding_index snapshot. Both backends are
+# optional dependencies (pip install hnswlib / faiss-cpu) and label vectors by snapshot row, so
+# hits map back to doc ids through the snapshot's id array. Candidates are re-scored exactly
+# against the memory-mapped float32 rows before the top k is taken.
+EMBEDDING_ANN_BACKEND = os.environ.get("EMBEDDING_ANN_BACKEND", "exact").lower()  # exact, hnsw, ivfpq
+# Candidates fetched per requested result; higher trades latency for recall
+EMBEDDING_ANN_OVERSAMPLE = int(os.environ.get("EMBEDDING_ANN_OVERSAMPLE", "4"))
+# Below this many vectors the exact scan is fast enough and no ANN structure is built
+EMBEDDING_ANN_MIN_VECTORS = int(os.environ.get("EMBEDDING_ANN_MIN_VECTORS", "50000"))
+
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "64"))
+
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # 0 = about 4 * sqrt(n)
+IVF_PQ_M = int(os.environ.get("IVF_PQ_M", "32"))  # sub-quantizers; must divide the dimension
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "16"))
+IVF_TRAIN_SAMPLE = int(os.environ.get("IVF_TRAIN_SAMPLE", "100000"))
+
+BUILD_CHUNK = 100000
+
+
+class HnswBackend:
+    """Graph index (hnswlib): best recall per millisecond, held fully in RAM"""
+    name = "hnsw"
+    filename = "hnsw.bin"
+
+    def __init__(self, index):
+        self.index = index
+
+    @classmethod
+    def build(cls, vectors, path, threads=-1):
+        import hnswlib
+        count, dim = vectors.shape
+        index = hnswlib.Index(space="ip", dim=dim)
+        index.init_index(max_elements=max(count, 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        for start in range(0, count, BUILD_CHUNK):
+            rows = np.asarray(vectors[start:start + BUILD_CHUNK], dtype=np.float32)
+            index.add_items(rows, np.arange(start, start + len(rows)), num_threads=threads)
+        index.save_index(path)
+
+    @classmethod
+    def load(cls, path, dim, count):
+        import hnswlib
+        index = hnswlib.Index(space="ip", dim=dim)
+        index.load_index(path, max_elements=max(count, 1))
+        return cls(index)
+
+    def search(self, query, k, ef=None):
+        self.index.set_ef(max(ef or HNSW_EF_SEARCH, k))
+        rows, _ = self.index.knn_query(query.reshape(1, -1), k=k)
+        return rows[0].astype(np.int64)
+
+
+class IvfPqBackend:
+    """Inverted lists of product-quantized codes (faiss): a few dozen bytes per vector, memory-mapped"""
+    name = "ivfpq"
+    filename = "ivfpq.faiss"
+
+    def __init__(self, index):
+        self.index = index
+
+    @classmethod
+    def build(cls, vectors, path, threads=-1):
+        import faiss
+        if threads > 0:
+            faiss.omp_set_num_threads(threads)
+        count, dim = vectors.shape
+        nlist = IVF_NLIST or max(1, min(int(4 * np.sqrt(count)), count // 39))
+        pq_m = IVF_PQ_M if dim % IVF_PQ_M == 0 else next(m for m in (16, 8, 4, 2, 1) if dim % m == 0)
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+
+        sample = np.sort(np.random.default_rng(0).choice(count, min(count, max(IVF_TRAIN_SAMPLE, nlist * 39)),
+                                                         replace=False))
+        index.train(np.asarray(vectors[sample], dtype=np.float32))
+        for start in range(0, count, BUILD_CHUNK):
+            rows = np.asarray(vectors[start:start + BUILD_CHUNK], dtype=np.float32)
+            index.add_with_ids(rows, np.arange(start, start + len(rows), dtype=np.int64))
+        faiss.write_index(index, path)
+
+    @classmethod
+    def load(cls, path, dim, count):
+        import faiss
+        return cls(faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY))
+
+    def search(self, query, k, nprobe=None):
+        self.index.nprobe = nprobe or IVF_NPROBE
+        _, rows = self.index.search(query.reshape(1, -1), k)
+        return rows[0]
+
+
+BACKENDS = {backend.name: backend for backend in (HnswBackend, IvfPqBackend)}
+
+
+def configured_backend():
+    """The backend class selected by EMBEDDING_ANN_BACKEND, or None for the exact scan"""
+    if EMBEDDING_ANN_BACKEND in ("", "exact"):
+        return None
+    if EMBEDDING_ANN_BACKEND not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_ANN_BACKEND {EMBEDDING_ANN_BACKEND!r}; use exact, hnsw or ivfpq")
+    return BACKENDS[EMBEDDING_ANN_BACKEND]
+
+
+def build_for_snapshot(directory, vectors):
+    """Build the configured ANN structure next to a snapshot; returns its name or None"""
+    backend = configured_backend()
+    if backend is None or len(vectors) < EMBEDDING_ANN_MIN_VECTORS:
+        return None
+    started = time.time()
+    try:
+        backend.build(vectors, os.path.join(directory, backend.filename))
+    except ImportError as e:
+        logger.warning(f"⚠️ {backend.name} backend unavailable ({e}); semantic search stays exact")
+        return None
+    logger.info(f"🧭 Built {backend.name} over {len(vectors)} vectors in {time.time() - started:.1f}s")
+    return backend.name
+
+
+def load_for_snapshot(directory, manifest):
+    """The snapshot's ANN structure if it was built with the configured backend, else None"""
+    backend = configured_backend()
+    if backend is None or manifest.get("ann") != backend.name:
+        return None
+    try:
+        return backend.load(os.path.join(directory, backend.filename), manifest["dim"], manifest["count"])
+    except (ImportError, RuntimeError, OSError) as e:
+        logger.warning(f"⚠️ Could not load {backend.name} index, falling back to exact scan: {e}")
+        return None
+
+
+def rerank(vectors, rows, query, k):
+    """Exact cosine scores for candidate snapshot rows; (rows, scores) of the best k"""
+    rows = np.unique(rows[rows >= 0])  # sorted, so the memmap is read front to back
+    scores = np.asarray(vectors[rows]) @ query
+    top = np.argsort(-scores)[:k]
+    return rows[top], scores[top]
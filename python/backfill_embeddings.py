@@ -0,0 +1,70 @@
+"""
+Convert JSONB embeddings in extracted_docs to the binary embedding_bin column.
+
+Streams rows in id order, one chunk per transaction, so it can be stopped and
+re-run at any time: rows that already have embedding_bin are skipped. The JSONB
+copy is cleared as each row is converted unless --keep-json is given.
+
+Usage:
+    python backfill_embeddings.py [--chunk-size 1000] [--format float32|float16|int8] [--keep-json]
+"""
+import argparse
+import time
+
+from sqlalchemy import select, bindparam, null
+
+import embedding_codec
+from db import SessionLocal
+from models import ExtractedDocs
+
+
+def backfill(db, chunk_size=1000, fmt=None, keep_json=False):
+    docs = ExtractedDocs.__table__
+    values = {"embedding_bin": bindparam("blob")}
+    if not keep_json:
+        values["embedding"] = null()
+    stmt = docs.update().where(docs.c.id == bindparam("doc_id")).values(**values)
+
+    last_id, converted, skipped, started = 0, 0, 0, time.time()
+    while True:
+        rows = db.execute(
+            select(docs.c.id, docs.c.embedding)
+            .where(docs.c.id > last_id, docs.c.embedding.isnot(None), docs.c.embedding_bin.is_(None))
+            .order_by(docs.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            vector = embedding_codec.row_vector(None, row.embedding)
+            if vector is None:
+                skipped += 1  # JSON null or an empty list
+                continue
+            params.append({"doc_id": row.id, "blob": embedding_codec.encode(vector, fmt)})
+        if params:
+            db.execute(stmt, params)
+        db.commit()
+        converted += len(params)
+        last_id = rows[-1].id
+        print(f"  ... {converted} converted (last id {last_id}, {converted / (time.time() - started):.0f} rows/s)")
+    return {"converted": converted, "skipped": skipped, "seconds": round(time.time() - started, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--format", choices=list(embedding_codec.FORMATS), default=None,
+                        help="defaults to EMBEDDING_STORAGE_FORMAT")
+    parser.add_argument("--keep-json", action="store_true", help="leave the JSONB copy in place")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(backfill(db, chunk_size=args.chunk_size, fmt=args.format, keep_json=args.keep_json))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
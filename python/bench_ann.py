@@ -0,0 +1,142 @@
+"""
+Benchmark the ANN backends of the semantic search index against the exact scan.
+
+Generates clustered synthetic embeddings (memory-mapped on disk), computes exact
+top-k ground truth, then builds each backend and reports build time, index size,
+query latency and recall@k for a sweep of its search parameter (ef for hnsw,
+nprobe for ivfpq). Queries go through the same over-fetch + exact re-rank as
+/api/semantic-search.
+
+5M vectors at the default 256 dims take ~5 GB of disk in --workdir; at the
+production 1536 dims budget ~30 GB, plus the index in RAM for hnsw.
+
+Usage:
+    python bench_ann.py [--sizes 100000 1000000 5000000] [--dim 256] [--backends exact hnsw ivfpq]
+    python bench_ann.py --sizes 100000 --ef 32 64 128 --nprobe 8 32 --oversample 2 4
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import ann_index
+from embedding_index import normalize
+
+CHUNK = 100000
+SPREAD = 1.0  # noise around each centre, relative to the centres' scale
+
+
+def synthetic_vectors(path, count, dim, clusters, seed=0):
+    """Unit vectors scattered around random cluster centres, like real document embeddings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = np.memmap(path, dtype=np.float32, mode="w+", shape=(count, dim))
+    for start in range(0, count, CHUNK):
+        n = min(CHUNK, count - start)
+        rows = centres[rng.integers(clusters, size=n)] + SPREAD * rng.normal(size=(n, dim)).astype(np.float32)
+        vectors[start:start + n] = normalize(rows)
+    vectors.flush()
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(count, dim)), centres
+
+
+def make_queries(centres, count, dim, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = centres[rng.integers(len(centres), size=count)] + SPREAD * rng.normal(size=(count, dim)).astype(np.float32)
+    return normalize(rows)
+
+
+def exact_top_k(vectors, queries, k):
+    """Ground-truth row ids, scanning the vectors once in chunks"""
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK):
+        scores = queries @ np.asarray(vectors[start:start + CHUNK]).T
+        rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        top = np.argpartition(-scores, min(k, scores.shape[1] - 1), axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return best_rows
+
+
+def measure(search, queries, truth, k):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        rows = search(query)
+        latencies.append(1000 * (time.perf_counter() - started))
+        hits += len(np.intersect1d(rows[:k], expected))
+    return np.percentile(latencies, 50), np.percentile(latencies, 95), hits / (k * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000, 5000000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=15)
+    parser.add_argument("--backends", nargs="+", default=["exact", "hnsw", "ivfpq"])
+    parser.add_argument("--ef", type=int, nargs="+", default=[32, 64, 128, 256])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--oversample", type=int, nargs="+", default=[ann_index.EMBEDDING_ANN_OVERSAMPLE])
+    parser.add_argument("--workdir", help="where vectors and indexes are written (default: a temp dir)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_ann_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        for size in args.sizes:
+            started = time.perf_counter()
+            vectors, centres = synthetic_vectors(os.path.join(workdir, f"vectors_{size}.f32"), size, args.dim,
+                                                 args.clusters)
+            queries = make_queries(centres, args.queries, args.dim)
+            truth = exact_top_k(vectors, queries, args.k)
+            print(f"\n== {size:,} vectors x {args.dim} dims (data + ground truth {time.perf_counter() - started:.0f}s)")
+
+            for name in args.backends:
+                if name == "exact":
+                    p50, p95, recall = measure(lambda q: np.argpartition(-(vectors @ q), args.k)[:args.k],
+                                               queries, truth, args.k)
+                    print(f"exact  | p50 {p50:8.2f} ms | p95 {p95:8.2f} ms | recall@{args.k} {recall:.3f}")
+                    continue
+
+                backend = ann_index.BACKENDS[name]
+                path = os.path.join(workdir, f"{size}_{backend.filename}")
+                started = time.perf_counter()
+                try:
+                    backend.build(vectors, path)
+                except ImportError as e:
+                    print(f"{name:6} | skipped: {e}")
+                    continue
+                build_secs = time.perf_counter() - started
+                index = backend.load(path, args.dim, size)
+                size_mb = os.path.getsize(path) / 2 ** 20
+                print(f"{name:6} | build {build_secs:7.1f} s | {size_mb:8.1f} MB on disk")
+
+                param = "ef" if name == "hnsw" else "nprobe"
+                for value in (args.ef if name == "hnsw" else args.nprobe):
+                    for oversample in args.oversample:
+                        wanted = args.k * oversample
+
+                        def search(q):
+                            rows = index.search(q, wanted, **{param: value})
+                            return ann_index.rerank(vectors, rows, q, args.k)[0]
+
+                        p50, p95, recall = measure(search, queries, truth, args.k)
+                        print(f"       | {param} {value:4} x{oversample} | p50 {p50:8.2f} ms | p95 {p95:8.2f} ms | "
+                              f"recall@{args.k} {recall:.3f}")
+                os.remove(path)
+            del vectors
+            os.remove(os.path.join(workdir, f"vectors_{size}.f32"))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
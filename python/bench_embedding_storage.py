@@ -0,0 +1,111 @@
+"""
+Compare read throughput of JSONB float lists against the binary embedding formats.
+
+Fills a scratch table with synthetic embeddings stored every way at once, then
+streams each column back (as the index rebuild does) into a float32 matrix and
+reports rows/s, bytes per row and, for the lossy formats, how much the top-k
+neighbours drift from float32. The table is dropped at the end unless --keep.
+
+Usage:
+    python bench_embedding_storage.py [--rows 100000] [--dim 1536] [--chunk-size 2000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, Table, func, insert, select
+from sqlalchemy.dialects.postgresql import JSONB
+
+import embedding_codec
+from db import engine
+
+TABLE_NAME = "bench_embedding_storage"
+
+
+def scratch_table():
+    metadata = MetaData()
+    columns = [Column("id", Integer, primary_key=True), Column("json_vec", JSONB)]
+    columns += [Column(f"bin_{fmt}", LargeBinary) for fmt in embedding_codec.FORMATS]
+    return Table(TABLE_NAME, metadata, *columns)
+
+
+def fill(conn, table, rows, dim, chunk_size):
+    rng = np.random.default_rng(0)
+    for start in range(0, rows, chunk_size):
+        vectors = rng.normal(size=(min(chunk_size, rows - start), dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        conn.execute(insert(table), [
+            {"id": start + i + 1, "json_vec": v.tolist(),
+             **{f"bin_{fmt}": embedding_codec.encode(v, fmt) for fmt in embedding_codec.FORMATS}}
+            for i, v in enumerate(vectors)
+        ])
+
+
+def read_all(conn, column, decode, chunk_size):
+    """Stream one column into an (n, dim) float32 matrix; returns the matrix and the seconds taken"""
+    started = time.perf_counter()
+    result = conn.execution_options(yield_per=chunk_size).execute(select(column).order_by(column.table.c.id))
+    parts = [np.stack([decode(value) for (value,) in chunk]) for chunk in result.partitions()]
+    return np.concatenate(parts), time.perf_counter() - started
+
+
+def payload_bytes(conn, table, column):
+    if conn.dialect.name == "postgresql":
+        return conn.execute(select(func.avg(func.pg_column_size(column)))).scalar()
+    sample = [value for (value,) in conn.execute(select(column).limit(100))]
+    return np.mean([len(json.dumps(v)) if isinstance(v, list) else len(v) for v in sample])
+
+
+def neighbour_overlap(reference, candidate, queries=50, k=10):
+    """Mean share of float32 top-k neighbours that the lossy copy also returns"""
+    overlap = 0
+    for q in reference[:queries]:
+        expected = np.argpartition(-(reference @ q), k)[:k]
+        got = np.argpartition(-(candidate @ q), k)[:k]
+        overlap += len(np.intersect1d(expected, got))
+    return overlap / (queries * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch table for repeated runs")
+    args = parser.parse_args()
+
+    engine.echo = False  # statement logging would dominate the timings
+    table = scratch_table()
+    with engine.connect() as conn:
+        if not conn.dialect.has_table(conn, TABLE_NAME) or not conn.execute(select(func.count()).select_from(table)).scalar():
+            table.create(conn, checkfirst=True)
+            started = time.perf_counter()
+            fill(conn, table, args.rows, args.dim, args.chunk_size)
+            conn.commit()
+            print(f"Filled {args.rows} rows x {args.dim} dims in {time.perf_counter() - started:.1f}s")
+
+        runs = [("jsonb", table.c.json_vec, lambda v: np.asarray(v, dtype=np.float32))]
+        runs += [(fmt, table.c[f"bin_{fmt}"], embedding_codec.decode) for fmt in embedding_codec.FORMATS]
+        reference = None
+        try:
+            for name, column, decode in runs:
+                matrix, seconds = read_all(conn, column, decode, args.chunk_size)
+                size = payload_bytes(conn, table, column)
+                line = (f"{name:8} | {len(matrix) / seconds:9.0f} rows/s | {seconds:7.2f} s | "
+                        f"{float(size):8.0f} bytes/row")
+                if name == "float32":
+                    reference = matrix
+                elif reference is not None:
+                    line += (f" | max abs err {np.abs(matrix - reference).max():.2e}"
+                             f" | top-10 overlap {neighbour_overlap(reference, matrix):.3f}")
+                print(line)
+        finally:
+            conn.rollback()
+            if not args.keep:
+                table.drop(conn)
+                conn.commit()
+
+
+if __name__ == "__main__":
+    main()
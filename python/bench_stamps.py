@@ -0,0 +1,81 @@
+"""
+Benchmark the fast stamp detector against the legacy full-resolution one.
+
+Reports per-page time at each render DPI and how often the two agree. With a
+labels CSV (columns: file,page,label where label is YES/NO) it also reports
+accuracy of both detectors against the hand labels.
+
+Usage:
+    python bench_stamps.py sample1.pdf sample2.pdf [--labels labels.csv] [--dpi 100 150 200 300]
+"""
+import argparse
+import csv
+import os
+import time
+
+from stamp_detection import detect_stamp_fast, detect_stamps_batch
+from tasks import iter_document_images, detect_stamps_legacy
+
+
+def load_labels(path):
+    labels = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            labels[(os.path.basename(row["file"]), int(row["page"]))] = row["label"].strip().upper()
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--labels")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[100, 150, 200, 300])
+    parser.add_argument("--roi", default="full", choices=["full", "bottom"])
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels) if args.labels else {}
+
+    for dpi in args.dpi:
+        legacy_secs = fast_secs = batch_secs = 0.0
+        pages = agree = 0
+        labelled = legacy_correct = fast_correct = 0
+
+        for path in args.files:
+            with open(path, "rb") as f:
+                binary = f.read()
+            imgs = [img.copy() for img in iter_document_images(binary, path, dpi=dpi)]
+
+            started = time.perf_counter()
+            legacy = [detect_stamps_legacy(img) for img in imgs]
+            legacy_secs += time.perf_counter() - started
+
+            started = time.perf_counter()
+            fast = [detect_stamp_fast(img, roi=args.roi) for img in imgs]
+            fast_secs += time.perf_counter() - started
+
+            started = time.perf_counter()
+            detect_stamps_batch(imgs, roi=args.roi)
+            batch_secs += time.perf_counter() - started
+
+            for i, (old, new) in enumerate(zip(legacy, fast)):
+                pages += 1
+                agree += old == new["status"]
+                label = labels.get((os.path.basename(path), i + 1))
+                if label:
+                    labelled += 1
+                    legacy_correct += old == label
+                    fast_correct += new["status"] == label
+
+        if not pages:
+            print("No pages processed.")
+            return
+
+        print(f"DPI {dpi}: legacy {1000 * legacy_secs / pages:7.1f} ms/page | "
+              f"fast {1000 * fast_secs / pages:6.1f} ms/page | batch {1000 * batch_secs / pages:6.1f} ms/page | "
+              f"agreement {agree}/{pages} ({100.0 * agree / pages:.1f}%)")
+        if labelled:
+            print(f"          labelled accuracy: legacy {legacy_correct}/{labelled}, fast {fast_correct}/{labelled}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os, io, mmap, hashlib, tempfile
+from contextlib import contextmanager
+
+# Content-addressed store for uploads, shared by the API and the workers.
+# Files live at <UPLOAD_STORE_DIR>/<sha[:2]>/<sha> and are written exactly once.
+UPLOAD_STORE_DIR = os.environ.get(
+    "UPLOAD_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+)
+
+
+class MappedBlob(io.RawIOBase):
+    """Read-only file object over a memory-mapped blob (pdfium and PIL read through it)"""
+
+    def __init__(self, mm):
+        super().__init__()
+        self._mm = mm
+        self._view = memoryview(mm) if mm is not None else memoryview(b"")
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def getbuffer(self):
+        return self._view
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, b):
+        end = min(self._pos + len(b), len(self._view))
+        n = max(0, end - self._pos)
+        b[:n] = self._view[self._pos:end]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            if self._mm is not None:
+                self._mm.close()
+        super().close()
+
+
+def blob_path(file_hash):
+    return os.path.join(UPLOAD_STORE_DIR, file_hash[:2], file_hash)
+
+
+def put_blob_stream(stream, chunk_size=1024 * 1024):
+    """Stream an upload into the store, hashing as it is written. Returns (file_hash, path)."""
+    os.makedirs(UPLOAD_STORE_DIR, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_STORE_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                tmp.write(chunk)
+
+        file_hash = sha.hexdigest()
+        path = blob_path(file_hash)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return file_hash, path
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def put_blob(data: bytes):
+    return put_blob_stream(io.BytesIO(data))
+
+
+def blob_exists(file_hash):
+    return os.path.exists(blob_path(file_hash))
+
+
+@contextmanager
+def open_blob(file_hash):
+    """Memory-map a stored upload read-only for the duration of the block"""
+    path = blob_path(file_hash)
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+    blob = MappedBlob(mm)
+    try:
+        yield blob
+    finally:
+        blob.close()
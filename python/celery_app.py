@@ -21,4 +21,10 @@ app.conf.update(
     task_acks_late=True,
     worker_prefetch_multiplier=1,
     broker_transport_options={'visibility_timeout': 3600},
+    # OCR_EXECUTOR=staged: page rendering/encoding runs on a prefork pool consuming "cpu",
+    # vision calls on a gevent/threads pool consuming "io". Everything else stays on the default queue.
+    task_routes={
+        'prepare_page': {'queue': 'cpu'},
+        'ocr_page': {'queue': 'io'},
+    },
 )
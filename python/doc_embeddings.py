@@ -0,0 +1,109 @@
+import os, hashlib, logging
+from sqlalchemy import func
+from sqlalchemy.orm import defer
+from models import ExtractedDocs
+from rate_limiter import acquire, estimate_tokens
+from embedding_codec import write_embedding
+
+logger = logging.getLogger(__name__)
+
+# Incremental, batched embedding of ExtractedDocs. A doc is (re-)embedded only when the hash of
+# its embedding text (and model) differs from embedding_hash, so re-runs only pay for changes.
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))  # texts per API request
+# Token cap per request; the embeddings API rejects requests above 300k tokens
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "200000"))
+EMBEDDING_CHUNK_SIZE = int(os.environ.get("EMBEDDING_CHUNK_SIZE", "1000"))  # docs per DB transaction
+
+
+# Rich embedding builder (recommended)
+def build_rich_doc_text(d: ExtractedDocs) -> str:
+    pieces = [
+        f"Invoice: {d.invoice_no or ''}",
+        f"LR: {d.lr_no or ''}",
+        f"Truck: {d.truck_no or ''}",
+        f"BillTo: {d.bill_to_party or ''}",
+        f"ShipTo: {d.ship_to_party or ''}",
+        f"Company: {d.principal_company or ''}",
+        f"Origin: {d.origin or ''}",
+        f"Destination: {d.destination or ''}",
+        f"Acknowledgement: {d.acknowledgement_status or ''}",
+        f"OrderType: {d.order_type or ''}"
+    ]
+    # join with newlines for context
+    return "\n".join(pieces)
+
+
+def embedding_text_hash(text):
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode()).hexdigest()
+
+
+def iter_batches(items):
+    """Split (doc, text, hash) items into requests bounded by count and estimated tokens"""
+    batch, tokens = [], 0
+    for item in items:
+        cost = estimate_tokens(item[1])
+        if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or tokens + cost > EMBEDDING_BATCH_TOKENS):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += cost
+    if batch:
+        yield batch
+
+
+def embed_texts(client, texts):
+    """One embeddings request for many texts; vectors come back in input order"""
+    acquire(EMBEDDING_MODEL, sum(estimate_tokens(t) for t in texts), priority="bulk")
+    resp = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in sorted(resp.data, key=lambda item: item.index)]
+
+
+def generate_embeddings(db, client, upload_ids=None, force=False, chunk_size=EMBEDDING_CHUNK_SIZE, on_progress=None):
+    """
+    Embed docs whose text changed since their last embedding, committing every chunk_size docs.
+    on_progress(scanned, total, stats) is called after each commit. Safe to re-run after a failure.
+    """
+    scope = [ExtractedDocs.upload_id.in_(upload_ids)] if upload_ids else []
+    total = db.query(func.count(ExtractedDocs.id)).filter(*scope).scalar()
+    stats = {"scanned": 0, "embedded": 0, "unchanged": 0, "requests": 0}
+
+    last_id = 0
+    while True:
+        docs = (
+            db.query(ExtractedDocs)
+            .options(defer(ExtractedDocs.embedding), defer(ExtractedDocs.embedding_bin), defer(ExtractedDocs.raw_text))
+            .filter(*scope, ExtractedDocs.id > last_id)
+            .order_by(ExtractedDocs.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not docs:
+            break
+
+        pending = []
+        for d in docs:
+            text = build_rich_doc_text(d)
+            text_hash = embedding_text_hash(text)
+            if not force and d.embedding_hash == text_hash:
+                stats["unchanged"] += 1
+                continue
+            pending.append((d, text, text_hash))
+
+        for batch in iter_batches(pending):
+            vectors = embed_texts(client, [text for _, text, _ in batch])
+            stats["requests"] += 1
+            for (d, _, text_hash), vector in zip(batch, vectors):
+                write_embedding(d, vector)
+                d.embedding_hash = text_hash
+            stats["embedded"] += len(batch)
+
+        db.commit()
+        last_id = docs[-1].id
+        stats["scanned"] += len(docs)
+        if on_progress:
+            on_progress(stats["scanned"], total, stats)
+
+    logger.info(f"🧬 Embeddings: {stats['embedded']} embedded, {stats['unchanged']} unchanged "
+                f"in {stats['requests']} requests")
+    return stats
@@ -0,0 +1,64 @@
+import os, struct
+import numpy as np
+from sqlalchemy import null
+
+# Binary storage for ExtractedDocs embeddings. Every blob starts with one format byte so rows
+# written with different settings can be read side by side:
+#   float32 - 4 bytes per dim, lossless
+#   float16 - 2 bytes per dim, ~1e-3 relative error, ranking effectively unchanged
+#   int8    - 1 byte per dim plus a float32 scale, symmetric per-vector quantization
+EMBEDDING_STORAGE_FORMAT = os.environ.get("EMBEDDING_STORAGE_FORMAT", "float32").lower()
+
+FORMATS = {"float32": 1, "float16": 2, "int8": 3}
+FORMAT_NAMES = {code: name for name, code in FORMATS.items()}
+
+
+def encode(vector, fmt=None):
+    """Pack a vector into the blob stored in extracted_docs.embedding_bin"""
+    fmt = fmt or EMBEDDING_STORAGE_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown embedding format {fmt!r}; use one of {', '.join(FORMATS)}")
+    vector = np.asarray(vector, dtype=np.float32)
+    header = bytes([FORMATS[fmt]])
+    if fmt == "float32":
+        return header + vector.astype("<f4").tobytes()
+    if fmt == "float16":
+        return header + vector.astype("<f2").tobytes()
+    scale = float(np.abs(vector).max()) / 127 or 1.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return header + struct.pack("<f", scale) + codes.tobytes()
+
+
+def decode(blob):
+    """float32 vector of a stored blob"""
+    blob = bytes(blob)  # psycopg2 hands back memoryview
+    fmt = FORMAT_NAMES.get(blob[0])
+    if fmt == "float32":
+        return np.frombuffer(blob, dtype="<f4", offset=1).astype(np.float32)
+    if fmt == "float16":
+        return np.frombuffer(blob, dtype="<f2", offset=1).astype(np.float32)
+    if fmt == "int8":
+        scale = struct.unpack_from("<f", blob, 1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=5).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding format byte {blob[0]}")
+
+
+def row_vector(blob, legacy=None):
+    """Embedding of a row from its binary column, or from the JSONB list of a row not yet backfilled"""
+    if blob is not None:
+        return decode(blob)
+    if isinstance(legacy, list) and legacy:
+        return np.asarray(legacy, dtype=np.float32)
+    return None
+
+
+def read_embedding(doc):
+    if doc.embedding_bin is not None:
+        return decode(doc.embedding_bin)
+    return row_vector(None, doc.embedding)
+
+
+def write_embedding(doc, vector):
+    """Store a new embedding on an ExtractedDocs row and drop its JSONB copy"""
+    doc.embedding_bin = encode(vector)
+    doc.embedding = null()  # SQL NULL; a plain None would be stored as JSON null
@@ -0,0 +1,417 @@
+import os, json, time, shutil, logging, threading
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import event, inspect, select, or_
+import ann_index
+from embedding_codec import row_vector, read_embedding
+
+try:
+    import fcntl
+except ImportError:  # Windows (run_all.bat local mode)
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Resident vector index for /api/semantic-search. A versioned snapshot on local disk holds the
+# L2-normalized float32 embeddings and their doc ids; every gunicorn worker memory-maps it, so the
+# page cache keeps a single copy. Changes made after the snapshot are appended to a per-version
+# delta log that all processes tail, and the delta is folded into a new snapshot once it grows.
+EMBEDDING_INDEX_ENABLED = os.environ.get("EMBEDDING_INDEX_ENABLED", "true").lower() == "true"
+EMBEDDING_INDEX_DIR = os.environ.get(
+    "EMBEDDING_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_index")
+)
+EMBEDDING_DELTA_MAX = int(os.environ.get("EMBEDDING_DELTA_MAX", "20000"))  # rows before a rebuild
+EMBEDDING_BUILD_CHUNK = int(os.environ.get("EMBEDDING_BUILD_CHUNK", "2000"))
+
+MANIFEST = "manifest.json"
+LOCK_FILE = ".lock"
+BUILD_LOCK_FILE = ".build.lock"
+
+
+def _path(*parts):
+    return os.path.join(EMBEDDING_INDEX_DIR, *parts)
+
+
+@contextmanager
+def _file_lock(name=LOCK_FILE):
+    """Exclusive lock shared by every process that writes the index"""
+    os.makedirs(EMBEDDING_INDEX_DIR, exist_ok=True)
+    with open(_path(name), "a+") as f:
+        _lock_file(f)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # gives up after ~10s of retries
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_manifest():
+    try:
+        with open(_path(MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest):
+    tmp = _path(MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _path(MANIFEST))  # readers see the old or the new version, never half of one
+
+
+def _delta_dtype(dim):
+    # live=0 marks a removed doc
+    return np.dtype([("id", "<i8"), ("live", "u1"), ("vec", "<f4", (dim,))])
+
+
+def normalize(vectors):
+    """float32 copies of the rows scaled to unit length; zero rows stay zero"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+# ---------------- Writing ----------------
+def rebuild(session_factory):
+    """
+    Write a fresh snapshot of every embedded doc and switch readers to it.
+    Delta rows appended while the table is scanned are carried over into the new version.
+    """
+    with _file_lock(BUILD_LOCK_FILE):
+        return _rebuild(session_factory)
+
+
+def _rebuild(session_factory):
+    from models import ExtractedDocs
+
+    with _file_lock():
+        previous = read_manifest()
+        carry_from = _delta_size(previous)
+
+    snapshot = f"build-{int(time.time() * 1000)}"
+    directory = _path(snapshot)
+    os.makedirs(directory)
+
+    db = session_factory()
+    dim, count, started = None, 0, time.time()
+    try:
+        rows = db.execute(
+            select(ExtractedDocs.id, ExtractedDocs.embedding_bin, ExtractedDocs.embedding)
+            .where(or_(ExtractedDocs.embedding_bin.isnot(None), ExtractedDocs.embedding.isnot(None)))
+            .order_by(ExtractedDocs.id)
+            .execution_options(yield_per=EMBEDDING_BUILD_CHUNK)
+        )
+        with open(os.path.join(directory, "vectors.f32"), "wb") as vf, \
+                open(os.path.join(directory, "ids.i64"), "wb") as idf:
+            for chunk in rows.partitions():
+                chunk = [(r.id, row_vector(r.embedding_bin, r.embedding)) for r in chunk]
+                chunk = [(doc_id, vec) for doc_id, vec in chunk if vec is not None]
+                if not chunk:
+                    continue
+                if dim is None:
+                    dim = len(chunk[0][1])
+                chunk = [(doc_id, vec) for doc_id, vec in chunk if len(vec) == dim]
+                vf.write(normalize([vec for _, vec in chunk]).tobytes())
+                idf.write(np.asarray([doc_id for doc_id, _ in chunk], dtype=np.int64).tobytes())
+                count += len(chunk)
+    finally:
+        db.close()
+
+    ann = None
+    if count and dim:
+        vectors = np.memmap(os.path.join(directory, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim))
+        ann = ann_index.build_for_snapshot(directory, vectors)
+        del vectors
+
+    with _file_lock():
+        current = read_manifest()
+        dim = dim or (current or {}).get("dim")
+        with open(os.path.join(directory, "delta.bin"), "wb") as out:
+            if current and current.get("dim") == dim:
+                # Changes appended since the scan began; the first ever embeddings may have started a new version
+                same = previous is not None and current["version"] == previous["version"]
+                with open(_path(current["snapshot"], "delta.bin"), "rb") as f:
+                    f.seek(carry_from if same else 0)
+                    shutil.copyfileobj(f, out)
+        version = (current or {}).get("version", 0) + 1
+        _write_manifest({
+            "version": version, "snapshot": snapshot, "dim": dim, "count": count, "built_at": time.time(),
+            "ann": ann, "ann_requested": ann_index.EMBEDDING_ANN_BACKEND,
+        })
+    for old in {(m or {}).get("snapshot") for m in (previous, current)} - {None}:
+        shutil.rmtree(_path(old), ignore_errors=True)  # open memmaps stay readable
+    logger.info(f"🧭 Embedding index v{version}: {count} vectors of dim {dim} in {time.time() - started:.1f}s")
+    return {"version": version, "count": count, "dim": dim}
+
+
+def _delta_size(manifest):
+    if not manifest:
+        return 0
+    try:
+        return os.path.getsize(_path(manifest["snapshot"], "delta.bin"))
+    except OSError:
+        return 0
+
+
+def _append(entries):
+    """Append (doc_id, embedding or None) changes to the current delta log"""
+    if not entries:
+        return
+    with _file_lock():
+        manifest = read_manifest()
+        if manifest is None or manifest.get("dim") is None:
+            dims = [len(e) for _, e in entries if e is not None]
+            if not dims:
+                return
+            # First embeddings ever: start an empty version so the delta has somewhere to go
+            manifest = {"version": (manifest or {}).get("version", 0) + 1, "dim": dims[0], "count": 0,
+                        "built_at": time.time()}
+            manifest["snapshot"] = f"build-{int(time.time() * 1000)}"
+            directory = _path(manifest["snapshot"])
+            os.makedirs(directory, exist_ok=True)
+            for name in ("vectors.f32", "ids.i64", "delta.bin"):
+                open(os.path.join(directory, name), "wb").close()
+            _write_manifest(manifest)
+
+        dim = manifest["dim"]
+        records = np.zeros(len(entries), dtype=_delta_dtype(dim))
+        kept = 0
+        for doc_id, embedding in entries:
+            if embedding is not None and len(embedding) != dim:
+                logger.warning(f"⚠️ Embedding of doc {doc_id} has dim {len(embedding)}, index uses {dim}")
+                continue
+            records[kept]["id"] = doc_id
+            if embedding is not None:
+                records[kept]["live"] = 1
+                records[kept]["vec"] = normalize(embedding)
+            kept += 1
+        with open(_path(manifest["snapshot"], "delta.bin"), "ab") as f:
+            f.write(records[:kept].tobytes())
+
+
+def upsert(doc_id, embedding):
+    upsert_many([(doc_id, embedding)])
+
+
+def upsert_many(entries):
+    """Record new or changed embeddings; never fails the caller"""
+    if not EMBEDDING_INDEX_ENABLED:
+        return
+    try:
+        _append([(doc_id, embedding) for doc_id, embedding in entries])
+    except OSError as e:
+        logger.warning(f"⚠️ Could not update the embedding index: {e}")
+
+
+def remove_many(doc_ids):
+    upsert_many([(doc_id, None) for doc_id in doc_ids])
+
+
+_watched = set()  # session factories already wired up (main imports tasks, both watch)
+
+
+def watch_sessions(session_factory):
+    """
+    Keep the index in step with ORM changes: embeddings added, changed or deleted through
+    sessions from this factory are appended to the delta once the transaction commits.
+    """
+    if not EMBEDDING_INDEX_ENABLED or session_factory in _watched:
+        return
+    _watched.add(session_factory)
+    from models import ExtractedDocs
+
+    @event.listens_for(session_factory, "after_flush")
+    def _collect(session, flush_context):
+        pending = session.info.setdefault("embedding_changes", {})
+        for obj in session.new:
+            if isinstance(obj, ExtractedDocs):
+                vector = read_embedding(obj)
+                if vector is not None:
+                    pending[obj.id] = vector
+        for obj in session.dirty:
+            if isinstance(obj, ExtractedDocs) and inspect(obj).attrs.embedding_bin.history.has_changes():
+                pending[obj.id] = read_embedding(obj)
+        for obj in session.deleted:
+            if isinstance(obj, ExtractedDocs):
+                pending[obj.id] = None
+
+    @event.listens_for(session_factory, "after_commit")
+    def _apply(session):
+        pending = session.info.pop("embedding_changes", None)
+        if pending:
+            upsert_many(pending.items())
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _discard(session):
+        session.info.pop("embedding_changes", None)
+
+
+# ---------------- Reading ----------------
+class EmbeddingIndex:
+    """One process's view of the shared index: memory-mapped snapshot plus the tailed delta"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rebuilding = threading.Event()
+        self.manifest = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.ann = None
+        self._delta = {}
+        self._delta_offset = 0
+        self._delta_arrays = None
+
+    def _load_snapshot(self, manifest):
+        dim, count = manifest["dim"] or 0, manifest["count"]
+        directory = _path(manifest["snapshot"])
+        if count:
+            self.vectors = np.memmap(os.path.join(directory, "vectors.f32"), dtype=np.float32, mode="r",
+                                     shape=(count, dim))
+            self.ids = np.memmap(os.path.join(directory, "ids.i64"), dtype=np.int64, mode="r", shape=(count,))
+        else:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+        self.ann = ann_index.load_for_snapshot(directory, manifest) if count else None
+        self.manifest = manifest
+        self._delta, self._delta_offset, self._delta_arrays = {}, 0, None
+
+    def _tail_delta(self):
+        dtype = _delta_dtype(self.manifest["dim"])
+        try:
+            with open(_path(self.manifest["snapshot"], "delta.bin"), "rb") as f:
+                f.seek(self._delta_offset)
+                payload = f.read()
+        except OSError:
+            return
+        whole = len(payload) - len(payload) % dtype.itemsize  # a writer may be mid-append
+        if not whole:
+            return
+        for record in np.frombuffer(payload[:whole], dtype=dtype):
+            self._delta[int(record["id"])] = record["vec"].copy() if record["live"] else None
+        self._delta_offset += whole
+        self._delta_arrays = None
+
+    def refresh(self):
+        """Pick up a new snapshot version and any delta rows appended since the last call"""
+        with self._lock:
+            manifest = read_manifest()
+            if manifest is None or manifest.get("dim") is None:
+                return False
+            if self.manifest is None or manifest["version"] != self.manifest["version"]:
+                self._load_snapshot(manifest)
+            self._tail_delta()
+            return True
+
+    def _delta_matrix(self):
+        if self._delta_arrays is None:
+            ids = np.fromiter(self._delta, dtype=np.int64, count=len(self._delta))
+            live = [(doc_id, vec) for doc_id, vec in self._delta.items() if vec is not None]
+            live_ids = np.asarray([doc_id for doc_id, _ in live], dtype=np.int64)
+            live_vecs = (np.stack([vec for _, vec in live]) if live
+                         else np.zeros((0, self.manifest["dim"]), dtype=np.float32))
+            # Only changed ids that are in the snapshot can come back stale from the ANN search
+            superseded = int(np.count_nonzero(np.isin(ids, self.ids)))
+            self._delta_arrays = (np.sort(ids), live_ids, live_vecs, superseded)
+        return self._delta_arrays
+
+    def search(self, query, k=15):
+        """[(doc_id, cosine score)] of the k nearest docs, best first"""
+        if not self.refresh():
+            return []
+        query = normalize(query)
+        if len(query) != self.manifest["dim"]:
+            raise ValueError(f"query has dim {len(query)}, index uses {self.manifest['dim']}")
+
+        changed_ids, delta_ids, delta_vecs, superseded = self._delta_matrix()
+        if self.ann is not None:
+            # Over-fetch so that candidates superseded by the delta still leave k behind
+            wanted = min((k + superseded) * ann_index.EMBEDDING_ANN_OVERSAMPLE, len(self.ids))
+            rows, scores = ann_index.rerank(self.vectors, self.ann.search(query, wanted), query, wanted)
+            ids = self.ids[rows]
+        else:
+            scores = self.vectors @ query
+            ids = self.ids
+        if len(changed_ids) and len(ids):
+            # Rows superseded or removed by the delta must not be returned from the snapshot
+            pos = np.searchsorted(changed_ids, ids)
+            stale = changed_ids[np.minimum(pos, len(changed_ids) - 1)] == ids
+            scores = np.where(stale, -np.inf, scores)
+        if len(delta_ids):
+            scores = np.concatenate([scores, delta_vecs @ query])
+            ids = np.concatenate([ids, delta_ids])
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def maybe_rebuild(self, session_factory):
+        """Fold a large delta (or a snapshot lacking the configured ANN structure) into a new snapshot"""
+        if self.manifest is None or self._rebuilding.is_set():
+            return
+        if len(self._delta) < EMBEDDING_DELTA_MAX and not self._missing_ann():
+            return
+        self._rebuilding.set()
+
+        def run():
+            try:
+                rebuild(session_factory)
+            except Exception as e:
+                logger.error(f"❌ Embedding index rebuild failed: {e}")
+            finally:
+                self._rebuilding.clear()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _missing_ann(self):
+        backend = ann_index.configured_backend()
+        # ann_requested rather than ann, so a backend that failed to import is not rebuilt on every query
+        return (backend is not None and self.manifest.get("ann_requested") != backend.name
+                and self.manifest["count"] >= ann_index.EMBEDDING_ANN_MIN_VECTORS)
+
+    def stats(self):
+        self.refresh()
+        return {
+            "version": (self.manifest or {}).get("version"),
+            "dim": (self.manifest or {}).get("dim"),
+            "snapshot_vectors": len(self.ids),
+            "delta_rows": len(self._delta),
+            "ann": (self.manifest or {}).get("ann") if self.ann is not None else None,
+            "built_at": (self.manifest or {}).get("built_at"),
+        }
+
+
+_index = EmbeddingIndex()
+
+
+def get_index(session_factory):
+    """The process-wide index, built from the database the first time it is needed"""
+    if read_manifest() is None:
+        with _file_lock(BUILD_LOCK_FILE):
+            if read_manifest() is None:  # another worker may have built it while we waited
+                _rebuild(session_factory)
+    return _index
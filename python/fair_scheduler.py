@@ -0,0 +1,179 @@
+import os, json, time, uuid, logging
+import redis
+from celery_app import app, BROKER_URL
+from redis_client import get_redis as _get_redis
+
+logger = logging.getLogger(__name__)
+
+# Fair-share admission in front of process_document: uploads wait in per-tenant Redis lists and
+# are released to Celery by weighted round-robin, with a per-tenant cap on running uploads.
+# Small uploads go through a priority lane with its own FAIR_PRIORITY_SLOTS slots, served first
+# and round-robin across tenants like the bulk lane, under the same per-tenant cap.
+# Tenants are the uploader's company (main.upload_tenant), never a client-supplied value.
+# Fairness is per upload, not per page: once dispatched, an upload that fans out
+# (OCR_FANOUT or OCR_EXECUTOR=staged) puts all its page tasks on the shared FIFO cpu/io
+# queues, where a 500-page upload is served ahead of pages queued after it. The per-tenant
+# running cap bounds how many such uploads one tenant has in flight; admission control
+# (admission.py) bounds the total page backlog.
+FAIR_SCHEDULER_ENABLED = os.environ.get("FAIR_SCHEDULER_ENABLED", "false").lower() == "true"
+FAIR_REDIS_URL = os.environ.get("FAIR_REDIS_URL", BROKER_URL)
+# Bulk uploads share FAIR_MAX_RUNNING slots; the priority lane may use FAIR_PRIORITY_SLOTS more,
+# so the sum should match total worker concurrency.
+FAIR_MAX_RUNNING = int(os.environ.get("FAIR_MAX_RUNNING", "6"))
+FAIR_PRIORITY_SLOTS = int(os.environ.get("FAIR_PRIORITY_SLOTS", "2"))
+FAIR_TENANT_MAX_RUNNING = int(os.environ.get("FAIR_TENANT_MAX_RUNNING", "2"))
+FAIR_TENANT_WEIGHTS = json.loads(os.environ.get("FAIR_TENANT_WEIGHTS", "{}"))  # {"acme": 3}
+FAIR_SMALL_UPLOAD_PAGES = int(os.environ.get("FAIR_SMALL_UPLOAD_PAGES", "3"))
+# A running slot not released within this many seconds (lost worker) is reclaimed
+FAIR_RUNNING_TTL = int(os.environ.get("FAIR_RUNNING_TTL", "10800"))
+
+RUNNING_KEY = "fair:running"          # zset file_hash -> start time
+RUNNING_TENANT_KEY = "fair:running:tenant"  # hash file_hash -> tenant
+RUNNING_LANE_KEY = "fair:running:lane"      # hash file_hash -> lane
+LOCK_KEY = "fair:lock"
+
+# Each lane keeps per-tenant queues and a ring of tenants with queued work
+LANES = {
+    "priority": {"queue": "fair:pq:", "ring": "fair:pring", "members": "fair:pring:members"},
+    "bulk": {"queue": "fair:q:", "ring": "fair:ring", "members": "fair:ring:members"},
+}
+
+DEFAULT_TENANT = "default"
+
+
+def get_redis():
+    return _get_redis(FAIR_REDIS_URL)
+
+
+def tenant_weight(tenant):
+    return max(1, int(FAIR_TENANT_WEIGHTS.get(tenant, 1)))
+
+
+def lane_slots(lane):
+    return FAIR_PRIORITY_SLOTS if lane == "priority" else FAIR_MAX_RUNNING
+
+
+def submit(tenant, task_id, file_hash, filename, pages):
+    """Queue an upload for its tenant; process_document runs later under task_id"""
+    r = get_redis()
+    lane = "priority" if pages <= FAIR_SMALL_UPLOAD_PAGES else "bulk"
+    job = json.dumps({"task_id": task_id, "file_hash": file_hash, "filename": filename,
+                      "tenant": tenant, "pages": pages, "lane": lane, "queued_at": time.time()})
+    keys = LANES[lane]
+    r.rpush(keys["queue"] + tenant, job)
+    if r.sadd(keys["members"], tenant):
+        r.rpush(keys["ring"], tenant)
+
+
+def _start(r, job):
+    pipe = r.pipeline()
+    pipe.zadd(RUNNING_KEY, {job["file_hash"]: time.time()})
+    pipe.hset(RUNNING_TENANT_KEY, job["file_hash"], job["tenant"])
+    pipe.hset(RUNNING_LANE_KEY, job["file_hash"], job["lane"])
+    pipe.execute()
+    app.send_task("process_document", args=[job["file_hash"], job["filename"]], task_id=job["task_id"])
+    logger.info(f"🚦 Dispatched {job['filename']} for {job['tenant']} after {time.time() - job['queued_at']:.1f}s")
+
+
+def _running(r):
+    """Running uploads counted per tenant and per lane"""
+    stale = r.zrangebyscore(RUNNING_KEY, 0, time.time() - FAIR_RUNNING_TTL)
+    if stale:
+        r.zrem(RUNNING_KEY, *stale)
+        r.hdel(RUNNING_TENANT_KEY, *stale)
+        r.hdel(RUNNING_LANE_KEY, *stale)
+    lanes = r.hgetall(RUNNING_LANE_KEY)
+    by_tenant, by_lane = {}, {lane: 0 for lane in LANES}
+    for file_hash, tenant in r.hgetall(RUNNING_TENANT_KEY).items():
+        by_tenant[tenant] = by_tenant.get(tenant, 0) + 1
+        lane = lanes.get(file_hash, "bulk")
+        by_lane[lane] = by_lane.get(lane, 0) + 1
+    return by_tenant, by_lane
+
+
+def _drop_from_ring(r, lane, tenant):
+    keys = LANES[lane]
+    pipe = r.pipeline()
+    pipe.lrem(keys["ring"], 0, tenant)
+    pipe.srem(keys["members"], tenant)
+    pipe.execute()
+    # A submit may have raced the removal; put the tenant back if it has work again
+    if r.llen(keys["queue"] + tenant) and r.sadd(keys["members"], tenant):
+        r.rpush(keys["ring"], tenant)
+
+
+def _serve_lane(r, lane, running, lane_running):
+    """Weighted round-robin: each turn a tenant may start up to its weight, within its cap"""
+    keys = LANES[lane]
+    dispatched, idle_turns = 0, 0
+    while lane_running[lane] < lane_slots(lane) and idle_turns < r.llen(keys["ring"]):
+        tenant = r.lmove(keys["ring"], keys["ring"], "LEFT", "RIGHT")
+        if tenant is None:
+            break
+        quota = min(tenant_weight(tenant), FAIR_TENANT_MAX_RUNNING - running.get(tenant, 0))
+        started = 0
+        while started < quota and lane_running[lane] < lane_slots(lane):
+            payload = r.lpop(keys["queue"] + tenant)
+            if payload is None:
+                _drop_from_ring(r, lane, tenant)
+                break
+            _start(r, json.loads(payload))
+            started += 1
+            lane_running[lane] += 1
+        running[tenant] = running.get(tenant, 0) + started
+        dispatched += started
+        idle_turns = 0 if started else idle_turns + 1
+    return dispatched
+
+
+def _dispatch_locked(r):
+    running, lane_running = _running(r)
+    # Priority lane first: small uploads only wait for one of its own slots, not for bulk backlogs
+    return sum(_serve_lane(r, lane, running, lane_running) for lane in ("priority", "bulk"))
+
+
+def dispatch():
+    """Release as many queued uploads as slots allow; safe to call from any process"""
+    r = get_redis()
+    token = str(uuid.uuid4())
+    for _ in range(20):
+        if r.set(LOCK_KEY, token, nx=True, px=10000):
+            break
+        time.sleep(0.05)
+    else:
+        return 0  # another process is dispatching and will pick up our jobs
+    try:
+        return _dispatch_locked(r)
+    finally:
+        if r.get(LOCK_KEY) == token:
+            r.delete(LOCK_KEY)
+
+
+def release(file_hash):
+    """Free the running slot of a finished (or failed) upload and dispatch the next ones; never raises"""
+    if not FAIR_SCHEDULER_ENABLED:
+        return
+    try:
+        r = get_redis()
+        if r.zrem(RUNNING_KEY, file_hash):
+            r.hdel(RUNNING_TENANT_KEY, file_hash)
+            r.hdel(RUNNING_LANE_KEY, file_hash)
+            dispatch()
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Fair scheduler unavailable while releasing {file_hash}: {e}")
+
+
+def scheduler_stats():
+    r = get_redis()
+    queued = {lane: {tenant: r.llen(keys["queue"] + tenant) for tenant in r.smembers(keys["members"])}
+              for lane, keys in LANES.items()}
+    running, lane_running = _running(r)
+    return {
+        "priority_queued": queued["priority"],
+        "queued": queued["bulk"],
+        "running": running,
+        "running_by_lane": lane_running,
+        "max_running": FAIR_MAX_RUNNING,
+        "priority_slots": FAIR_PRIORITY_SLOTS,
+        "tenant_max_running": FAIR_TENANT_MAX_RUNNING,
+    }
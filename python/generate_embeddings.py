@@ -1,25 +1,20 @@
 from openai import OpenAI
 from db import SessionLocal
-from models import ExtractedDocs
-import json
+from doc_embeddings import generate_embeddings
+import embedding_index
 
+# Runs the same incremental job as /admin/generate-embeddings, in this process:
+# only docs whose text changed since their last embedding are sent, in batched requests.
 client = OpenAI()
+embedding_index.watch_sessions(SessionLocal)
 db = SessionLocal()
 
-docs = db.query(ExtractedDocs).all()
 
-for d in docs:
-    text = f"{d.invoice_no or ''} {d.lr_no or ''} {d.truck_no or ''} {d.bill_to_party or ''} {d.ship_to_party or ''}".strip()
+def report(scanned, total, stats):
+    print(f"Scanned {scanned}/{total}: {stats['embedded']} embedded, {stats['unchanged']} unchanged")
 
-    emb = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    ).data[0].embedding
 
-    d.embedding = emb  # List → JSONB automatically
-    print("Updated:", d.id)
-
-db.commit()
+stats = generate_embeddings(db, client, on_progress=report)
 db.close()
 
-print("🔥 Embeddings updated successfully!")
+print("🔥 Embeddings updated successfully!", stats)
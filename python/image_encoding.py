@@ -0,0 +1,75 @@
+import os, base64, math
+from io import BytesIO
+from PIL import Image
+
+# Per-deployment encoding profiles for page images sent to the vision model.
+# "lossless" reproduces the original full-resolution PNG payload.
+ENCODING_PROFILES = {
+    "lossless": {"grayscale": False, "max_long_edge": None, "format": "PNG", "quality": None, "detail": "high"},
+    "balanced": {"grayscale": True, "max_long_edge": 2048, "format": "JPEG", "quality": 85, "detail": "high"},
+    "economy": {"grayscale": True, "max_long_edge": 1600, "format": "WEBP", "quality": 75, "detail": "high"},
+    "preview": {"grayscale": True, "max_long_edge": 768, "format": "JPEG", "quality": 70, "detail": "low"},
+}
+
+OCR_IMAGE_PROFILE = os.environ.get("OCR_IMAGE_PROFILE", "lossless")
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def get_profile(profile=None):
+    """Resolve a profile name (or dict) to its settings; defaults to OCR_IMAGE_PROFILE"""
+    if isinstance(profile, dict):
+        return profile
+    name = profile or OCR_IMAGE_PROFILE
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown OCR image profile: {name}")
+    return ENCODING_PROFILES[name]
+
+
+def estimate_image_tokens(width, height, detail="high"):
+    """Vision token cost of one image, following OpenAI's 512px tiling rules"""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 170 * tiles + 85
+
+
+def encode_page_image(img, profile=None):
+    """
+    Encode a rendered page for the OCR request according to a profile.
+    Returns the base64 payload plus what it costs: bytes sent and estimated image tokens.
+    """
+    settings = get_profile(profile)
+
+    if settings["grayscale"]:
+        img = img.convert("L")
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    max_edge = settings["max_long_edge"]
+    if max_edge and max(img.size) > max_edge:
+        ratio = max_edge / max(img.size)
+        img = img.resize((round(img.width * ratio), round(img.height * ratio)), Image.LANCZOS)
+
+    fmt = settings["format"]
+    save_kwargs = {"quality": settings["quality"]} if settings["quality"] else {}
+    if fmt == "JPEG":
+        save_kwargs["optimize"] = True
+
+    buf = BytesIO()
+    img.save(buf, format=fmt, **save_kwargs)
+    payload = buf.getvalue()
+
+    return {
+        "b64": base64.b64encode(payload).decode(),
+        "mime": MIME_TYPES[fmt],
+        "detail": settings["detail"],
+        "bytes": len(payload),
+        "width": img.width,
+        "height": img.height,
+        "est_image_tokens": estimate_image_tokens(img.width, img.height, settings["detail"]),
+    }
@@ -3,20 +3,34 @@ import re
 import os
 import json
 import base64
-import requests
+import uuid
+import threading
+import redis
 import numpy as np
 from datetime import datetime, date
 from typing import Optional
 
-import openai
-from flask import Flask, request, jsonify
+import jwt
+from openai import OpenAI
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from celery.result import AsyncResult
 
 from sqlalchemy import or_
 from db import SessionLocal
-from models import ExtractedDocs, LinkedTrip, TripDocument
-from tasks import process_document_task
+from models import ExtractedDocs, LinkedTrip, TripDocument, User
+from tasks import process_document_task, generate_embeddings_task, count_pages
+from blob_store import put_blob, put_blob_stream, open_blob
+from upload_dedup import seed_known_hashes, is_known, claim_inflight, settle_upload
+import page_cache
+import fair_scheduler
+import admission
+import progress_events
+import embedding_index
+import query_cache
+from embedding_codec import read_embedding
+from doc_embeddings import EMBEDDING_MODEL
+from rate_limiter import acquire, estimate_tokens
 from celery_app import app as celery_app
 
 # ------------------------ CONFIG ------------------------
@@ -25,10 +39,16 @@ CORS(flask_app)
 
 # Use environment variable for safety
 openai_key = os.environ.get("OPENAI_API_KEY")
+client = OpenAI(api_key=openai_key)
+# Secret the web app signs login tokens with; uploads are attributed to the token's user
+JWT_SECRET = os.environ.get("JWT_SECRET", "test_secret")
 
 def get_db():
     return SessionLocal()
 
+# Embedding changes committed through our sessions flow into the semantic search index
+embedding_index.watch_sessions(SessionLocal)
+
 # ------------------------ UTILITIES ------------------------
 
 def cosine_similarity(a, b):
@@ -110,11 +130,17 @@ def heuristic_parse(query: str) -> dict:
 def llm_parse_query(query: str) -> dict:
     """
     Use LLM to extract structured fields from a free-text query.
-    Falls back to heuristic_parse on failure.
+    Repeat queries are answered from query_cache; falls back to heuristic_parse on failure.
     """
     if not query:
         return {"invoice_no": "", "lr_no": "", "truck_no": "", "buyer": ""}
 
+    parsed = query_cache.parse_cache.get_or_compute(query, lambda: _llm_parse_query(query))
+    return parsed if parsed is not None else heuristic_parse(query)
+
+
+def _llm_parse_query(query: str) -> Optional[dict]:
+    """The model call behind llm_parse_query; None when it fails, so failures aren't cached"""
     prompt = f"""
 You are a logistics assistant. Given a short user query, extract exactly and only the following JSON object:
 
@@ -127,21 +153,14 @@ Query: "{query}"
 """
 
     try:
-        resp = openai.ChatCompletion.create(
+        acquire("gpt-4o-mini", estimate_tokens(prompt) + 200, priority="interactive")
+        resp = client.chat.completions.create(
             model="gpt-4o-mini",
             temperature=0,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=200
         )
-        text = ""
-        # handle dict-like or object responses
-        if isinstance(resp, dict):
-            text = resp.get("choices", [{}])[0].get("message", {}).get("content", "") or resp.get("choices", [{}])[0].get("text", "")
-        else:
-            try:
-                text = resp.choices[0].message.content
-            except Exception:
-                text = ""
+        text = resp.choices[0].message.content or ""
 
         parsed = extract_json_from_text(text)
         if isinstance(parsed, dict):
@@ -155,7 +174,7 @@ Query: "{query}"
         # print/log for debugging
         print("LLM parse failed:", e)
 
-    return heuristic_parse(query)
+    return None
 
 
 # ------------------------ SERIALIZERS ------------------------
@@ -183,18 +202,19 @@ def health():
     return {"status": "ok"}
 
 
-# Process document (unchanged)
+# Process document: the upload is written once to the blob store and only its hash is queued
 @flask_app.route("/api/process-doc", methods=["POST"])
 def process_doc():
     try:
-        file_b64 = None
+        file_hash = None
         filename = None
+        tenant = upload_tenant()
 
         if 'document' in request.files:
             file = request.files['document']
             if file.filename == '':
                 return jsonify({"detail": "Empty filename"}), 400
-            file_b64 = base64.b64encode(file.read()).decode('utf-8')
+            file_hash, _ = put_blob_stream(file.stream)
             filename = file.filename
         elif request.is_json:
             data = request.get_json()
@@ -202,16 +222,96 @@ def process_doc():
             filename = data.get('original_filename')
             if not file_b64 or not filename:
                 return jsonify({"detail": "Missing file_content_b64 or original_filename"}), 400
+            file_hash, _ = put_blob(base64.b64decode(file_b64))
         else:
             return jsonify({"detail": "No file uploaded"}), 400
 
-        task = process_document_task.delay(file_b64, filename)
+        # Re-sent files are answered here and never reach the queue
+        task_id = str(uuid.uuid4())
+        try:
+            db = get_db()
+            try:
+                seed_known_hashes(db)
+            finally:
+                db.close()
+            if is_known(file_hash):
+                return jsonify({"status": "Duplicate", "taskId": None, "fileHash": file_hash}), 200
+            existing_task_id = claim_inflight(file_hash, task_id)
+            if existing_task_id:
+                return jsonify({"status": "Task received", "taskId": existing_task_id, "duplicate": True}), 202
+        except redis.RedisError as e:
+            # Dedup is best effort; the worker still rejects duplicates against UploadMetadata
+            print("Upload dedup unavailable:", e)
+
+        try:
+            pages = None
+            if admission.ADMISSION_ENABLED or fair_scheduler.FAIR_SCHEDULER_ENABLED:
+                with open_blob(file_hash) as binary:
+                    pages = count_pages(binary, filename)
+            if admission.ADMISSION_ENABLED:
+                refused = admit_upload(tenant, task_id, file_hash, filename, pages)
+                if refused:
+                    return refused
+            if fair_scheduler.FAIR_SCHEDULER_ENABLED and submit_fair(tenant, task_id, file_hash, filename, pages):
+                return jsonify({"status": "Task received", "taskId": task_id}), 202
+            task = process_document_task.apply_async(args=[file_hash, filename], task_id=task_id)
+        except Exception:
+            settle_upload(file_hash, completed=False)
+            raise
         return jsonify({"status": "Task received", "taskId": task.id}), 202
 
     except Exception as e:
         return jsonify({"detail": str(e)}), 500
 
 
+def upload_tenant():
+    """
+    Fair-share tenant of the uploader: the company of the user in the bearer token.
+    Anonymous or invalid tokens share the default tenant; the client never picks its own.
+    """
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return fair_scheduler.DEFAULT_TENANT
+    try:
+        email = jwt.decode(auth[len("Bearer "):], JWT_SECRET, algorithms=["HS256"]).get("email")
+    except jwt.InvalidTokenError:
+        return fair_scheduler.DEFAULT_TENANT
+    db = get_db()
+    try:
+        company = db.query(User.company_name).filter(User.email == email).scalar()
+    finally:
+        db.close()
+    return (company or "").strip() or fair_scheduler.DEFAULT_TENANT
+
+
+def admit_upload(tenant, task_id, file_hash, filename, pages):
+    """Admission control; returns the response for an upload that is rejected or deferred, else None"""
+    try:
+        decision, wait = admission.admit(pages)
+        if decision == "reject":
+            settle_upload(file_hash, completed=False)
+            body = {"status": "Busy", "detail": f"Processing queue is full, retry in {wait}s", "retryAfter": wait}
+            return jsonify(body), 429, {"Retry-After": str(wait)}
+        if decision == "defer":
+            admission.defer(tenant, task_id, file_hash, filename, pages)
+            return jsonify({"status": "Deferred", "taskId": task_id}), 202
+        admission.track(file_hash, pages)
+    except redis.RedisError as e:
+        print("Admission control unavailable:", e)
+    return None
+
+
+def submit_fair(tenant, task_id, file_hash, filename, pages):
+    """Queue an upload behind its tenant's fair share; False if the scheduler is unreachable"""
+    try:
+        fair_scheduler.submit(tenant, task_id, file_hash, filename, pages)
+        fair_scheduler.dispatch()
+        return True
+    except redis.RedisError as e:
+        print("Fair scheduler unavailable, enqueueing directly:", e)
+        return False
+
+
 # Task status
 @flask_app.route("/api/tasks/status/<task_id>", methods=["GET"])
 def get_status_path(task_id):
@@ -222,7 +322,42 @@ def get_status_path(task_id):
         return jsonify({"status": "PROCESSING", "progress": task.info.get("progress")}), 200
     if task.state == "FAILURE":
         return jsonify({"status": "FAILURE", "error": str(task.info)}), 200
-    return jsonify({"status": "SUCCESS"}), 200
+    if task.state == "REVOKED":
+        return jsonify({"status": "FAILURE", "error": "Task was cancelled"}), 200
+    if task.state == "SUCCESS":
+        return jsonify({"status": "SUCCESS"}), 200
+    # STARTED, RETRY (waiting out a backoff) and any custom state: still running
+    return jsonify({"status": "PROCESSING"}), 200
+
+
+# Task progress as Server-Sent Events
+@flask_app.route("/api/tasks/events/<task_id>", methods=["GET"])
+def get_task_events(task_id):
+    def fallback_event():
+        # Task finished before it published anything (or its events expired)
+        task = AsyncResult(task_id, app=celery_app)
+        if task.state == "SUCCESS":
+            return {"type": "complete", "taskId": task_id, **(task.result or {})}
+        if task.state == "FAILURE":
+            return {"type": "failed", "taskId": task_id, "error": str(task.info)}
+        return None
+
+    try:
+        events = progress_events.stream(task_id, fallback_event)
+        first = next(events, None)  # surfaces a Redis outage before the stream starts
+    except redis.RedisError as e:
+        return jsonify({"error": f"Progress events unavailable: {e}"}), 503
+
+    def generate():
+        if first:
+            yield first
+        yield from events
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # Get all docs
@@ -442,56 +577,31 @@ def download_doc(doc_id):
 
 
 # ------------------------ EMBEDDING GENERATION ------------------------
-# Rich embedding builder (recommended)
-def build_rich_doc_text(d: ExtractedDocs) -> str:
-    pieces = [
-        f"Invoice: {d.invoice_no or ''}",
-        f"LR: {d.lr_no or ''}",
-        f"Truck: {d.truck_no or ''}",
-        f"BillTo: {d.bill_to_party or ''}",
-        f"ShipTo: {d.ship_to_party or ''}",
-        f"Company: {d.principal_company or ''}",
-        f"Origin: {d.origin or ''}",
-        f"Destination: {d.destination or ''}",
-        f"Acknowledgement: {d.acknowledgement_status or ''}",
-        f"OrderType: {d.order_type or ''}"
-    ]
-    # join with newlines for context
-    return "\n".join(pieces)
-
-
 @flask_app.route("/admin/generate-embeddings", methods=["POST"])
 def generate_embeddings():
     """
-    Admin endpoint to generate/update embeddings for all documents.
-    POST only. No auth here — add auth in production.
+    Admin endpoint: queue a background job that embeds docs whose text changed since their last embedding.
+    Optional JSON body: {"force": true} to re-embed everything, {"upload_ids": [...]} to limit the scope.
+    Progress is reported through /api/tasks/status and /api/tasks/events. No auth here — add auth in production.
     """
-    db = get_db()
+    data = request.get_json(silent=True) or {}
     try:
-        client = openai  # using openai.Embedding.create
-        docs = db.query(ExtractedDocs).all()
-        updated = 0
-        for d in docs:
-            doc_text = build_rich_doc_text(d)
-            if not doc_text.strip():
-                continue
-            try:
-                resp = client.Embedding.create(model="text-embedding-3-small", input=doc_text)
-                emb = resp["data"][0]["embedding"]
-                d.embedding = emb  # JSONB accepts Python list
-                updated += 1
-            except Exception as e:
-                print(f"Embedding failed for doc {d.id}: {e}")
-        db.commit()
-        return jsonify({"status": "ok", "updated": updated}), 200
+        task = generate_embeddings_task.apply_async(
+            kwargs={"upload_ids": data.get("upload_ids"), "force": bool(data.get("force"))}
+        )
+        return jsonify({"status": "queued", "taskId": task.id}), 202
     except Exception as e:
-        db.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.close()
 
 
 # ------------------------ SEMANTIC SEARCH (JSONB) ------------------------
+def embed_query(query_text):
+    # Same model as the stored doc embeddings, or the vectors aren't comparable
+    acquire(EMBEDDING_MODEL, estimate_tokens(query_text), priority="interactive")
+    emb_resp = client.embeddings.create(model=EMBEDDING_MODEL, input=query_text)
+    return emb_resp.data[0].embedding
+
+
 @flask_app.route("/api/semantic-search", methods=["GET"])
 def semantic_search():
     db = get_db()
@@ -503,9 +613,9 @@ def semantic_search():
         return jsonify({"count": 0, "results": []})
 
     try:
-        # 1) Let LLM interpret
+        # 1) Let LLM interpret (cached per normalized query)
         try:
-            llm_parse = requests.post("http://127.0.0.1:5000/api/llm/understand", json={"query": query_text}, timeout=4).json()
+            llm_parse = llm_parse_query(query_text)
         except Exception:
             llm_parse = {}
 
@@ -528,22 +638,32 @@ def semantic_search():
             return jsonify({"mode": "keyword", "llm_extract": llm_parse, "count": len(results), "results": results})
 
         # Slow path: semantic search via JSONB embeddings + python cosine
-        emb_resp = openai.Embedding.create(model="text-embedding-3-small", input=query_text)
-        query_emb = emb_resp["data"][0]["embedding"]
-
-        # fetch documents that have embedding
-        all_docs = db.query(ExtractedDocs).filter(ExtractedDocs.embedding.isnot(None)).all()
-        scored = []
-        for d in all_docs:
-            try:
-                score = cosine_similarity(query_emb, d.embedding)
-                scored.append((score, d))
-            except Exception:
-                continue
-
-        # sort and take top N
-        scored.sort(key=lambda x: x[0], reverse=True)
-        top = scored[:15]
+        query_emb = query_cache.embedding_cache.get_or_compute(query_text, lambda: embed_query(query_text))
+
+        if embedding_index.EMBEDDING_INDEX_ENABLED:
+            # one matrix-vector product over the memory-mapped index, then load only the winners
+            index = embedding_index.get_index(SessionLocal)
+            hits = index.search(query_emb, k=15)
+            index.maybe_rebuild(SessionLocal)
+            hit_ids = [doc_id for doc_id, _ in hits]
+            docs_by_id = {d.id: d for d in db.query(ExtractedDocs).filter(ExtractedDocs.id.in_(hit_ids)).all()}
+            top = [(score, docs_by_id[doc_id]) for doc_id, score in hits if doc_id in docs_by_id]
+        else:
+            # fetch documents that have embedding
+            all_docs = db.query(ExtractedDocs).filter(
+                or_(ExtractedDocs.embedding_bin.isnot(None), ExtractedDocs.embedding.isnot(None))
+            ).all()
+            scored = []
+            for d in all_docs:
+                try:
+                    score = cosine_similarity(query_emb, read_embedding(d))
+                    scored.append((score, d))
+                except Exception:
+                    continue
+
+            # sort and take top N
+            scored.sort(key=lambda x: x[0], reverse=True)
+            top = scored[:15]
         top_docs = [serialize_doc(doc) for score, doc in top]
 
         # optional rerank using LLM for final ordering (keep it lightweight)
@@ -561,8 +681,9 @@ Return ONLY JSON array of objects with fields index (1-based) and score (0.0-1.0
 Items:
 {prompt_items}
 """
-                resp = openai.ChatCompletion.create(model="gpt-4o-mini", temperature=0, messages=[{"role":"user","content":prompt}], max_tokens=300)
-                txt = resp["choices"][0]["message"]["content"]
+                acquire("gpt-4o-mini", estimate_tokens(prompt) + 300, priority="interactive")
+                resp = client.chat.completions.create(model="gpt-4o-mini", temperature=0, messages=[{"role":"user","content":prompt}], max_tokens=300)
+                txt = resp.choices[0].message.content
                 arr = json.loads(txt)
                 # build map index->score and reorder
                 score_map = {item["index"]-1: item["score"] for item in arr if isinstance(item.get("index"), int)}
@@ -594,6 +715,57 @@ def admin_health():
     finally:
         db.close()
 
+@flask_app.route("/admin/page-cache/stats", methods=["GET"])
+def page_cache_stats():
+    """Hit/miss/eviction counters of the page-level OCR cache"""
+    try:
+        return jsonify(page_cache.cache_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@flask_app.route("/admin/embedding-index/stats", methods=["GET"])
+def embedding_index_stats():
+    """Snapshot version, vector count and pending delta rows of the semantic search index"""
+    try:
+        return jsonify(embedding_index.get_index(SessionLocal).stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@flask_app.route("/admin/embedding-index/rebuild", methods=["POST"])
+def embedding_index_rebuild():
+    """Rebuild the semantic search index from the database in the background"""
+    threading.Thread(target=embedding_index.rebuild, args=(SessionLocal,), daemon=True).start()
+    return jsonify({"status": "started"}), 202
+
+
+@flask_app.route("/admin/query-cache/stats", methods=["GET"])
+def query_cache_stats():
+    """Hit/miss/eviction counters of the query parse and query embedding caches"""
+    try:
+        return jsonify(query_cache.cache_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@flask_app.route("/admin/queue/metrics", methods=["GET"])
+def queue_metrics():
+    """Broker queue depth, page backlog and deferred uploads, for autoscaling"""
+    try:
+        return jsonify(admission.admission_metrics())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@flask_app.route("/admin/scheduler/stats", methods=["GET"])
+def scheduler_stats():
+    """Queued and running uploads per tenant in the fair scheduler"""
+    try:
+        return jsonify(fair_scheduler.scheduler_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # ------------------------ GET DOCS BY COMPANY ------------------------
 @flask_app.route("/api/get-docs", methods=["GET"])
 def get_docs_by_company():
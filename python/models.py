@@ -1,6 +1,7 @@
 # --- File: models.py ---
 from sqlalchemy import (
-    Column, Integer, String, Numeric, DateTime, ForeignKey, Text, Boolean, func, Date, Float, TIMESTAMP, text
+    Column, Integer, String, Numeric, DateTime, ForeignKey, Text, Boolean, func, Date, Float, TIMESTAMP, text,
+    UniqueConstraint, LargeBinary
 )
 from sqlalchemy.orm import relationship
 from db import Base # Assuming 'db' module contains the declarative base
@@ -37,6 +38,7 @@ class ExtractedDocs(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     upload_id = Column(Integer, ForeignKey('upload_metadata.id'))
+    page_no = Column(Integer, nullable=True)  # matches ExtractedPage.page_no of the checkpoint
 
     doc_category = Column(String(50))
     invoice_no = Column(String(255))
@@ -63,7 +65,9 @@ class ExtractedDocs(Base):
     last_validated_by = Column(String(50))
 
     # 🚀 ADD THIS
-    embedding = Column(JSONB)
+    embedding = Column(JSONB)  # legacy float lists; read through embedding_codec until backfilled
+    embedding_bin = Column(LargeBinary)  # embedding_codec blob
+    embedding_hash = Column(String(64))  # doc_embeddings.embedding_text_hash of the embedded text
 
 
     upload_metadata = relationship("UploadMetadata", back_populates="extracted_docs")
@@ -126,6 +130,8 @@ class TripDocument(Base):
 
 class ExtractedPage(Base):
     __tablename__ = "extracted_pages"
+    # One checkpoint per page of an upload
+    __table_args__ = (UniqueConstraint("upload_id", "page_no", name="uq_extracted_pages_upload_page"),)
 
     id = Column(Integer, primary_key=True, index=True)
     upload_id = Column(Integer, ForeignKey("upload_metadata.id"), nullable=False)
@@ -0,0 +1,84 @@
+import os, json, time, hashlib, logging
+import cv2, numpy as np
+import redis
+from celery_app import BROKER_URL
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Page-level OCR cache. A page is keyed by an exact hash of its content at OCR resolution, so only
+# an identical page (a re-uploaded PDF, a page repeated within a document) reuses the raw model JSON.
+# Near-duplicates are deliberately misses: two invoices of one template differ only in their fields.
+PAGE_CACHE_ENABLED = os.environ.get("PAGE_CACHE_ENABLED", "false").lower() == "true"
+PAGE_CACHE_REDIS_URL = os.environ.get("PAGE_CACHE_REDIS_URL", BROKER_URL)
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", "50000"))
+# Long edge the page is reduced to for the content hash; the smallest OCR encoding profile uses 1600
+CONTENT_HASH_LONG_EDGE = 1600
+
+RAW_PREFIX = "pcache:raw:"
+LRU_KEY = "pcache:lru"
+STATS_KEY = "pcache:stats"
+
+
+def content_hash(img):
+    """SHA-256 of the page as grayscale at OCR resolution, quantized so re-rendering noise doesn't matter"""
+    gray = np.asarray(img.convert("L"))
+    scale = min(1.0, CONTENT_HASH_LONG_EDGE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)),
+                          interpolation=cv2.INTER_AREA)
+    digest = hashlib.sha256(f"{gray.shape[0]}x{gray.shape[1]}".encode())
+    digest.update((gray >> 3).tobytes())
+    return digest.hexdigest()
+
+
+page_key = content_hash
+
+
+def lookup(key):
+    """Cached raw OCR JSON for a page_key, or None"""
+    r = get_redis(PAGE_CACHE_REDIS_URL)
+    try:
+        payload = r.get(RAW_PREFIX + key)
+        if payload is None:
+            r.hincrby(STATS_KEY, "misses", 1)
+            return None
+        pipe = r.pipeline()
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.hincrby(STATS_KEY, "hits", 1)
+        pipe.execute()
+        return json.loads(payload)
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Page cache lookup failed: {e}")
+        return None
+
+
+def store(key, raw):
+    r = get_redis(PAGE_CACHE_REDIS_URL)
+    try:
+        pipe = r.pipeline()
+        pipe.set(RAW_PREFIX + key, json.dumps(raw))
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.execute()
+        _evict(r)
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Page cache store failed: {e}")
+
+
+def _evict(r):
+    excess = r.zcard(LRU_KEY) - PAGE_CACHE_MAX_ENTRIES
+    if excess <= 0:
+        return
+    pipe = r.pipeline()
+    for old in r.zrange(LRU_KEY, 0, excess - 1):
+        pipe.delete(RAW_PREFIX + old)
+        pipe.zrem(LRU_KEY, old)
+    pipe.hincrby(STATS_KEY, "evictions", excess)
+    pipe.execute()
+
+
+def cache_stats():
+    r = get_redis(PAGE_CACHE_REDIS_URL)
+    stats = {k: int(v) for k, v in r.hgetall(STATS_KEY).items()}
+    stats["entries"] = r.zcard(LRU_KEY)
+    return stats
@@ -0,0 +1,65 @@
+import os
+import cv2, numpy as np
+from stamp_detection import _downsample, _red_mask
+
+# Cheap pre-OCR page classifier: flags blank backs, cover sheets and photo pages so they
+# are not sent to the vision model. Runs on the same downsampled copy as the fast stamp detector.
+PAGE_FILTER_MODE = os.environ.get("PAGE_FILTER_MODE", "off").lower()  # "off", "flag" or "skip"
+PAGE_FILTER_LONG_EDGE = int(os.environ.get("PAGE_FILTER_LONG_EDGE", "800"))
+
+# Share of dark pixels below which a page counts as blank (scanner noise, punch holes)
+PAGE_BLANK_MAX_INK = float(os.environ.get("PAGE_BLANK_MAX_INK", "0.0005"))
+# Pages with at most this many text lines and little ink are cover/separator sheets
+PAGE_COVER_MAX_LINES = int(os.environ.get("PAGE_COVER_MAX_LINES", "4"))
+PAGE_COVER_MAX_INK = float(os.environ.get("PAGE_COVER_MAX_INK", "0.03"))
+# Share of mid-grey pixels above which a page is a photo rather than printed text. Text on
+# grey or yellowed paper is mostly mid-grey too, so a page with more than PAGE_PHOTO_MAX_LINES
+# text lines is never a photo.
+PAGE_PHOTO_MIN_MIDTONE = float(os.environ.get("PAGE_PHOTO_MIN_MIDTONE", "0.45"))
+PAGE_PHOTO_MAX_EDGES = float(os.environ.get("PAGE_PHOTO_MAX_EDGES", "0.08"))
+PAGE_PHOTO_MAX_LINES = int(os.environ.get("PAGE_PHOTO_MAX_LINES", "3"))
+# A page with this many red stamp pixels (at filter resolution) always goes to OCR
+PAGE_STAMP_MIN_PIXELS = int(os.environ.get("PAGE_STAMP_MIN_PIXELS", "20"))
+
+
+def _count_text_lines(ink):
+    """Rows of ink separated by blank rows, after smearing characters into horizontal bands"""
+    smeared = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 1)))
+    row_fill = np.count_nonzero(smeared, axis=1) / ink.shape[1]
+    rows = row_fill > 0.02
+    # Count rising edges of the row profile
+    return int(np.count_nonzero(rows[1:] & ~rows[:-1]) + rows[0])
+
+
+def page_features(img, long_edge=PAGE_FILTER_LONG_EDGE):
+    arr, _ = _downsample(img, long_edge, "full")
+    stamp = _red_mask(arr)
+    gray = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    gray[stamp > 0] = 255  # stamp ink is not text
+    ink = (gray < 128).astype(np.uint8)
+    total = gray.size
+    return {
+        "ink": float(np.count_nonzero(ink)) / total,
+        "midtone": float(np.count_nonzero((gray >= 60) & (gray < 200))) / total,
+        "edges": float(np.count_nonzero(cv2.Canny(gray, 50, 150))) / total,
+        "text_lines": _count_text_lines(ink),
+        "stamp_pixels": int(cv2.countNonZero(stamp)),
+    }
+
+
+def classify_page(img, long_edge=PAGE_FILTER_LONG_EDGE):
+    """Returns "document", "blank", "cover" or "photo"; anything unreadable counts as a document"""
+    try:
+        f = page_features(img, long_edge)
+    except Exception:
+        return "document"
+    if f["stamp_pixels"] >= PAGE_STAMP_MIN_PIXELS:
+        return "document"
+    if f["ink"] < PAGE_BLANK_MAX_INK:
+        return "blank"
+    if (f["midtone"] > PAGE_PHOTO_MIN_MIDTONE and f["edges"] < PAGE_PHOTO_MAX_EDGES
+            and f["text_lines"] <= PAGE_PHOTO_MAX_LINES):
+        return "photo"
+    if f["text_lines"] <= PAGE_COVER_MAX_LINES and f["ink"] < PAGE_COVER_MAX_INK:
+        return "cover"
+    return "document"
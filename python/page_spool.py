@@ -0,0 +1,36 @@
+import os, base64, tempfile
+
+# Local-disk hand-off between pipeline stages: the CPU stage writes each encoded page image
+# here and the OCR stage receives only a small reference. Both worker pools must share the directory.
+PAGE_SPOOL_DIR = os.environ.get(
+    "PAGE_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")
+)
+
+
+def spool_page(file_hash, page_no, encoded):
+    """Write an encoded page (see image_encoding) to disk; returns a JSON-serializable reference"""
+    directory = os.path.join(PAGE_SPOOL_DIR, file_hash)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{page_no}.img")
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(base64.b64decode(encoded["b64"]))
+    os.replace(tmp_path, path)  # readers never see a half-written page
+
+    return {"path": path, **{k: v for k, v in encoded.items() if k != "b64"}}
+
+
+def load_spooled(ref):
+    """The encoded page a reference points to, in the shape encode_page_image returns"""
+    with open(ref["path"], "rb") as f:
+        payload = f.read()
+    return {**{k: v for k, v in ref.items() if k != "path"}, "b64": base64.b64encode(payload).decode()}
+
+
+def release_spooled(ref):
+    try:
+        os.remove(ref["path"])
+        os.rmdir(os.path.dirname(ref["path"]))  # only succeeds once the upload's last page is gone
+    except OSError:
+        pass
@@ -0,0 +1,95 @@
+import os, json, time, logging
+import redis
+from celery_app import BROKER_URL
+from redis_client import get_redis as _get_redis
+
+logger = logging.getLogger(__name__)
+
+# Per-upload progress events over Redis pub/sub, streamed to browsers as Server-Sent Events.
+# The last event of each task is also kept so a stream opened late starts from the current state.
+PROGRESS_REDIS_URL = os.environ.get("PROGRESS_REDIS_URL", BROKER_URL)
+PROGRESS_TTL = int(os.environ.get("PROGRESS_TTL", "86400"))
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = int(os.environ.get("SSE_MAX_SECONDS", "3600"))
+
+CHANNEL_PREFIX = "progress:"
+LAST_PREFIX = "progress:last:"
+DONE_PREFIX = "progress:done:"
+TERMINAL_EVENTS = ("complete", "failed")
+
+
+def get_redis():
+    return _get_redis(PROGRESS_REDIS_URL)
+
+
+def publish(task_id, event):
+    """Publish one event for a task; progress is best effort and never fails the pipeline"""
+    if not task_id:
+        return
+    event = {**event, "taskId": task_id, "ts": time.time()}
+    payload = json.dumps(event)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.set(LAST_PREFIX + task_id, payload, ex=PROGRESS_TTL)
+        pipe.publish(CHANNEL_PREFIX + task_id, payload)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Could not publish progress for {task_id}: {e}")
+
+
+def publish_page(task_id, page_no, total, **extra):
+    """A page finished; `current` counts finished pages even when they complete out of order"""
+    if not task_id:
+        return
+    try:
+        r = get_redis()
+        current = r.incr(DONE_PREFIX + task_id)
+        r.expire(DONE_PREFIX + task_id, PROGRESS_TTL)
+    except redis.RedisError:
+        current = None
+    publish(task_id, {"type": "page", "page": page_no, "current": current, "total": total, **extra})
+
+
+def reset(task_id, done=0):
+    try:
+        get_redis().set(DONE_PREFIX + task_id, done, ex=PROGRESS_TTL)
+    except redis.RedisError:
+        pass
+
+
+def last_event(task_id):
+    payload = get_redis().get(LAST_PREFIX + task_id)
+    return json.loads(payload) if payload else None
+
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream(task_id, fallback_event=None):
+    """
+    SSE lines for one task: the latest known event, then live events until completion.
+    fallback_event() supplies a terminal event when the task finished before any was published.
+    """
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL_PREFIX + task_id)  # subscribe first so nothing falls between snapshot and live
+    try:
+        event = last_event(task_id) or (fallback_event() if fallback_event else None)
+        if event:
+            yield _sse(event)
+            if event["type"] in TERMINAL_EVENTS:
+                return
+
+        started = last_beat = time.monotonic()
+        while time.monotonic() - started < SSE_MAX_SECONDS:
+            message = pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "message":
+                event = json.loads(message["data"])
+                yield _sse(event)
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+            elif time.monotonic() - last_beat >= SSE_HEARTBEAT_SECONDS:
+                last_beat = time.monotonic()
+                yield ": keepalive\n\n"
+    finally:
+        pubsub.close()
@@ -0,0 +1,142 @@
+import os, json, time, hashlib, logging, threading
+from collections import OrderedDict
+import redis
+from celery_app import BROKER_URL
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Caches in front of the per-query model calls of search (LLM query parsing, query embeddings).
+# Each API worker keeps a bounded LRU with a TTL; with QUERY_CACHE_REDIS_ENABLED the workers
+# also share a Redis tier, so a query answered by one worker is a hit for all of them.
+QUERY_CACHE_ENABLED = os.environ.get("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "2048"))
+QUERY_CACHE_REDIS_ENABLED = os.environ.get("QUERY_CACHE_REDIS_ENABLED", "false").lower() == "true"
+QUERY_CACHE_REDIS_URL = os.environ.get("QUERY_CACHE_REDIS_URL", BROKER_URL)
+
+KEY_PREFIX = "qcache:"
+STATS_PREFIX = "qcache:stats:"
+
+
+def normalize_query(text):
+    """Cache key text: case-folded with runs of whitespace collapsed"""
+    return " ".join((text or "").casefold().split())
+
+
+class QueryCache:
+    """LRU + TTL cache of JSON-serializable values keyed by normalized query text"""
+
+    def __init__(self, name, ttl, max_entries=QUERY_CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _count(self, field, r=None):
+        self._stats[field] += 1
+        if r is not None:
+            try:
+                r.hincrby(STATS_PREFIX + self.name, field, 1)
+            except redis.RedisError:
+                pass
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _local_set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _redis(self):
+        return get_redis(QUERY_CACHE_REDIS_URL) if QUERY_CACHE_REDIS_ENABLED else None
+
+    def _redis_key(self, key):
+        return f"{KEY_PREFIX}{self.name}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def get_or_compute(self, query, compute):
+        """Cached value for the query, else compute() (None results are not cached)"""
+        if not QUERY_CACHE_ENABLED:
+            return compute()
+        key = normalize_query(query)
+        r = self._redis()
+
+        value = self._local_get(key)
+        if value is not None:
+            self._count("hits", r)
+            return value
+
+        if r is not None:
+            try:
+                payload = r.get(self._redis_key(key))
+                if payload is not None:
+                    value = json.loads(payload)
+                    # Keep the local copy no longer than the shared one has left
+                    self._local_set(key, value, max(r.ttl(self._redis_key(key)), 1))
+                    self._count("redis_hits", r)
+                    return value
+            except redis.RedisError as e:
+                logger.warning(f"⚠️ Query cache Redis tier unavailable: {e}")
+                r = None
+
+        self._count("misses", r)
+        value = compute()
+        if value is None:
+            return None
+        self._local_set(key, value, self.ttl)
+        if r is not None:
+            try:
+                r.set(self._redis_key(key), json.dumps(value), ex=self.ttl)
+            except redis.RedisError as e:
+                logger.warning(f"⚠️ Query cache Redis tier unavailable: {e}")
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            local = {**self._stats, "size": len(self._entries)}
+        lookups = local["hits"] + local["redis_hits"] + local["misses"]
+        result = {
+            "process": {**local, "hit_rate": round((local["hits"] + local["redis_hits"]) / lookups, 4) if lookups else None},
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+        }
+        r = self._redis()
+        if r is not None:
+            try:
+                shared = {k: int(v) for k, v in r.hgetall(STATS_PREFIX + self.name).items()}
+                result["all_workers"] = shared
+            except redis.RedisError as e:
+                result["all_workers"] = {"error": str(e)}
+        return result
+
+
+parse_cache = QueryCache("parse", int(os.environ.get("QUERY_PARSE_CACHE_TTL", "3600")))
+embedding_cache = QueryCache("embedding", int(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", "86400")))
+
+
+def cache_stats():
+    return {
+        "enabled": QUERY_CACHE_ENABLED,
+        "redis_tier": QUERY_CACHE_REDIS_ENABLED,
+        "pid": os.getpid(),
+        "parse": parse_cache.stats(),
+        "embedding": embedding_cache.stats(),
+    }
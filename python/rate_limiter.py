@@ -0,0 +1,124 @@
+import os, json, time, asyncio, logging
+import redis
+from celery_app import BROKER_URL
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Cluster-wide token buckets for OpenAI calls, shared by every worker and API process.
+# Each model has a requests/minute and tokens/minute budget; bulk callers may not drain
+# the last PRIORITY_RESERVE share of a bucket, which keeps headroom for interactive search.
+# Off unless RATE_LIMIT_ENABLED: the budgets must match the organisation's OpenAI limits
+# (Settings > Limits), so set OPENAI_RATE_LIMITS, e.g. '{"gpt-4o": {"rpm": 5000, "tpm": 800000}}'.
+# DEFAULT_LIMITS are the usage tier 1 limits, the most conservative choice.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", BROKER_URL)
+
+DEFAULT_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "text-embedding-3-small": {"rpm": 3000, "tpm": 1000000},
+}
+RATE_LIMITS = {**DEFAULT_LIMITS, **json.loads(os.environ.get("OPENAI_RATE_LIMITS", "{}"))}
+
+PRIORITY_RESERVE = {"interactive": 0.0, "bulk": 0.2}
+PRIORITY_MAX_WAIT = {
+    "interactive": float(os.environ.get("RATE_LIMIT_INTERACTIVE_MAX_WAIT", "10")),
+    "bulk": float(os.environ.get("RATE_LIMIT_BULK_MAX_WAIT", "120")),
+}
+
+# Returns 0 when granted, otherwise the seconds to wait before trying again
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[5])
+-- A request larger than the caller's usable share could never be granted
+local cost = math.min(tonumber(ARGV[4]), tpm * (1 - reserve))
+
+local state = redis.call('HMGET', key, 'req', 'tok', 'ts')
+local req = tonumber(state[1]) or rpm
+local tok = tonumber(state[2]) or tpm
+local ts = tonumber(state[3]) or now
+
+local elapsed = math.max(0, now - ts)
+req = math.min(rpm, req + elapsed * rpm / 60)
+tok = math.min(tpm, tok + elapsed * tpm / 60)
+
+local req_floor = rpm * reserve
+local tok_floor = tpm * reserve
+local wait = 0
+if req - 1 < req_floor then
+    wait = math.max(wait, (req_floor + 1 - req) * 60 / rpm)
+end
+if tok - cost < tok_floor then
+    wait = math.max(wait, (tok_floor + cost - tok) * 60 / tpm)
+end
+
+if wait == 0 then
+    req = req - 1
+    tok = tok - cost
+end
+redis.call('HSET', key, 'req', req, 'tok', tok, 'ts', now)
+redis.call('EXPIRE', key, 120)
+return tostring(wait)
+"""
+
+_script = None
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def estimate_tokens(text):
+    """Rough prompt size (~4 characters per token)"""
+    return len(text or "") // 4 + 1
+
+
+def _try_acquire(model, tokens, priority):
+    global _script
+    limits = RATE_LIMITS.get(model)
+    if not RATE_LIMIT_ENABLED or not limits:
+        return 0.0
+    usable = limits["tpm"] * (1 - PRIORITY_RESERVE[priority])
+    if tokens > usable:
+        logger.warning(f"⚠️ {tokens} token {model} request exceeds the {usable:.0f} TPM {priority} budget; "
+                       f"charging the full budget (raise OPENAI_RATE_LIMITS)")
+    try:
+        r = get_redis(RATE_LIMIT_REDIS_URL)
+        if _script is None:
+            _script = r.register_script(_TOKEN_BUCKET_LUA)
+        wait = _script(
+            keys=[f"ratelimit:{model}"],
+            args=[time.time(), limits["rpm"], limits["tpm"], tokens, PRIORITY_RESERVE[priority]],
+        )
+        return float(wait)
+    except redis.RedisError as e:
+        # The limiter must never take the pipeline down; fall back to the provider's own limits
+        logger.warning(f"⚠️ Rate limiter unavailable, proceeding: {e}")
+        return 0.0
+
+
+def acquire(model, tokens, priority="bulk"):
+    """Block until `model` has budget for one request of `tokens` tokens"""
+    deadline = time.monotonic() + PRIORITY_MAX_WAIT[priority]
+    while True:
+        wait = _try_acquire(model, tokens, priority)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(f"{model} budget exhausted for {priority} calls")
+        time.sleep(wait)
+
+
+async def acquire_async(model, tokens, priority="bulk"):
+    deadline = time.monotonic() + PRIORITY_MAX_WAIT[priority]
+    while True:
+        wait = _try_acquire(model, tokens, priority)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(f"{model} budget exhausted for {priority} calls")
+        await asyncio.sleep(wait)
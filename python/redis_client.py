@@ -0,0 +1,12 @@
+import redis
+from celery_app import BROKER_URL
+
+_clients = {}
+
+
+def get_redis(url=None):
+    """Shared Redis client per URL (defaults to the Celery broker)"""
+    url = url or BROKER_URL
+    if url not in _clients:
+        _clients[url] = redis.Redis.from_url(url, decode_responses=True)
+    return _clients[url]
@@ -0,0 +1,44 @@
+"""
+Re-apply the current normalization and linking rules to every checkpointed page.
+
+Reads the raw OCR output stored in ExtractedPage, so no model is called. Use
+--dry-run to print what would change without writing anything.
+
+Usage:
+    python replay_extractions.py --dry-run [--upload-id 12 --upload-id 13] [--show 20]
+    python replay_extractions.py [--chunk-size 1000]
+"""
+import argparse
+import json
+
+from db import SessionLocal
+from tasks import replay_extractions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--upload-id", type=int, action="append", dest="upload_ids")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--show", type=int, default=20, help="number of changed docs to print")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = replay_extractions(
+            db, dry_run=args.dry_run, upload_ids=args.upload_ids, chunk_size=args.chunk_size, max_samples=args.show
+        )
+    finally:
+        db.close()
+
+    for sample in summary.pop("samples"):
+        print(f"doc {sample['doc_id']} (upload {sample['upload_id']}, page {sample['page_no']}):")
+        for col, (old, new) in sample["changes"].items():
+            print(f"    {col}: {old!r} -> {new!r}")
+    print(json.dumps(summary, indent=2))
+    if args.dry_run:
+        print("Dry run: nothing was written.")
+
+
+if __name__ == "__main__":
+    main()
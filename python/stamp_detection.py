@@ -0,0 +1,67 @@
+import os, math
+import cv2, numpy as np
+
+# Fast red-stamp detector: works on a downsampled copy of the page (optionally only the
+# region where acknowledgement stamps usually sit) and returns a confidence score.
+STAMP_DETECT_LONG_EDGE = int(os.environ.get("STAMP_DETECT_LONG_EDGE", "800"))
+STAMP_DETECT_ROI = os.environ.get("STAMP_DETECT_ROI", "full")  # "full" or "bottom"
+
+# The legacy detector says YES above 150 red pixels on the full-resolution render;
+# counts on the downsampled copy are scaled back to that reference before scoring.
+REFERENCE_MIN_PIXELS = 150
+
+ROI_FRACTIONS = {
+    "full": (0.0, 1.0),
+    "bottom": (0.45, 1.0),  # signature/acknowledgement block of LR and invoice pages
+}
+
+
+def _downsample(img, long_edge, roi):
+    # PIL's box reduce runs on the raw image buffer, avoiding a full-resolution numpy copy
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    top, bottom = ROI_FRACTIONS[roi]
+    box = (0, int(img.height * top), img.width, int(img.height * bottom))
+    factor = max(1, math.ceil(max(img.size) / long_edge))
+    return np.asarray(img.reduce(factor, box=box)), 1.0 / factor
+
+
+def _red_mask(rgb):
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+    return cv2.inRange(hsv, (0, 50, 50), (10, 255, 255)) | cv2.inRange(hsv, (170, 50, 50), (180, 255, 255))
+
+
+def _score(red_pixels, scale):
+    # Equivalent pixel count at full resolution; confidence is 0.5 exactly at the legacy threshold
+    equivalent = red_pixels / (scale * scale)
+    confidence = equivalent / (equivalent + REFERENCE_MIN_PIXELS)
+    return {"status": "YES" if confidence > 0.5 else "NO", "confidence": round(confidence, 3)}
+
+
+def detect_stamp_fast(img, long_edge=STAMP_DETECT_LONG_EDGE, roi=STAMP_DETECT_ROI):
+    try:
+        arr, scale = _downsample(img, long_edge, roi)
+        return _score(cv2.countNonZero(_red_mask(arr)), scale)
+    except Exception:
+        return {"status": "N/A", "confidence": 0.0}
+
+
+def detect_stamps_batch(imgs, long_edge=STAMP_DETECT_LONG_EDGE, roi=STAMP_DETECT_ROI):
+    """Score several pages with a single colour conversion and mask pass"""
+    if not imgs:
+        return []
+    try:
+        pages = [_downsample(img, long_edge, roi) for img in imgs]
+        width = max(arr.shape[1] for arr, _ in pages)
+        stacked = np.zeros((sum(arr.shape[0] for arr, _ in pages), width, 3), dtype=np.uint8)
+        offsets, row = [], 0
+        for arr, _ in pages:
+            stacked[row:row + arr.shape[0], :arr.shape[1]] = arr
+            offsets.append(row)
+            row += arr.shape[0]
+
+        red_per_row = np.count_nonzero(_red_mask(stacked), axis=1)
+        counts = np.add.reduceat(red_per_row, offsets)
+        return [_score(int(count), scale) for count, (_, scale) in zip(counts, pages)]
+    except Exception:
+        return [{"status": "N/A", "confidence": 0.0} for _ in imgs]
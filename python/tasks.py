@@ -1,11 +1,29 @@
-import os, json, base64, re, logging, hashlib
+import os, json, re, time, random, logging, hashlib, asyncio
 from datetime import datetime
 from io import BytesIO
 from collections import defaultdict
-import cv2, numpy as np, pypdfium2 as pdfium
+import cv2, numpy as np, pypdfium2 as pdfium, pytesseract
 from PIL import Image
-from openai import OpenAI
+import openai
+from openai import OpenAI, AsyncOpenAI
+from celery import chord, chain
+from sqlalchemy import insert, update, delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from celery_app import app
+from image_encoding import encode_page_image
+from blob_store import open_blob, blob_path
+from upload_dedup import settle_upload, UNFINISHED_STATUSES
+import fair_scheduler
+import admission
+import progress_events
+import embedding_index
+from doc_embeddings import generate_embeddings
+import page_cache
+from page_cache import PAGE_CACHE_ENABLED, page_key
+from rate_limiter import acquire, acquire_async, estimate_tokens, RateLimitTimeout
+from stamp_detection import detect_stamp_fast
+from page_filter import PAGE_FILTER_MODE, classify_page
+from page_spool import spool_page, load_spooled, release_spooled
 from db import SessionLocal
 from models import (
     UploadMetadata, ExtractedDocs, WeighmentSlip, LinkedTrip,
@@ -14,21 +32,144 @@ from models import (
 
 logger = logging.getLogger(__name__)
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+embedding_index.watch_sessions(SessionLocal)
+
+# Fan-out mode: OCR the pages of one upload as parallel subtasks (chord) instead of serially
+OCR_FANOUT = os.environ.get("OCR_FANOUT", "false").lower() == "true"
+OCR_FANOUT_MIN_PAGES = int(os.environ.get("OCR_FANOUT_MIN_PAGES", "2"))
+
+# "async" keeps up to OCR_MAX_IN_FLIGHT page requests open per worker through one AsyncOpenAI client.
+# "staged" splits each page into a CPU task (queue "cpu") and an OCR task (queue "io"), see celery_app.
+OCR_EXECUTOR = os.environ.get("OCR_EXECUTOR", "sync").lower()
+OCR_MAX_IN_FLIGHT = int(os.environ.get("OCR_MAX_IN_FLIGHT", "16"))
+_async_client = None
+_event_loop = None
+
+# "fast" scores stamps on a downsampled copy (see stamp_detection); "legacy" scans the full render
+STAMP_DETECTOR = os.environ.get("STAMP_DETECTOR", "legacy").lower()
+
+# Fields a page must yield before a cheaper tier's answer is accepted.
+# Each entry is a required group; "A|B" is satisfied by either field.
+OCR_REQUIRED_FIELDS = os.environ.get(
+    "OCR_REQUIRED_FIELDS", "Vehicle_No,Invoice_No|LR_No,Invoice_Date|LR_Date,Ship_To_Party|Bill_To_Party"
+).split(",")
+
+# Tiered extraction: Tesseract + regex first, vision model only when required fields are missing
+LOCAL_OCR_ENABLED = os.environ.get("LOCAL_OCR_ENABLED", "false").lower() == "true"
+LOCAL_OCR_TIMEOUT = int(os.environ.get("LOCAL_OCR_TIMEOUT", "30"))
+
+# Vision model cascade, cheapest first; a page moves to the next model only when validation fails.
+# With more than one model, requests use a strict JSON schema that includes per-field confidence.
+OCR_MODEL_CASCADE = [m.strip() for m in os.environ.get("OCR_MODEL_CASCADE", "gpt-4o").split(",") if m.strip()]
+OCR_MIN_FIELD_CONFIDENCE = float(os.environ.get("OCR_MIN_FIELD_CONFIDENCE", "0.7"))
+
+# Batched OCR: up to OCR_BATCH_MAX_PAGES page images per vision request (1 disables batching).
+# A batch is closed early once its images would exceed the token or payload budget.
+OCR_BATCH_MAX_PAGES = int(os.environ.get("OCR_BATCH_MAX_PAGES", "1"))
+OCR_BATCH_TOKEN_BUDGET = int(os.environ.get("OCR_BATCH_TOKEN_BUDGET", "12000"))
+OCR_BATCH_MAX_BYTES = int(os.environ.get("OCR_BATCH_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Transient OCR failures are retried per page with exponential backoff (plus jitter);
+# a document that still fails is retried as a task up to UploadMetadata.max_retries,
+# resuming from the pages already checkpointed to ExtractedPage.
+OCR_PAGE_MAX_ATTEMPTS = int(os.environ.get("OCR_PAGE_MAX_ATTEMPTS", "4"))
+OCR_BACKOFF_BASE = float(os.environ.get("OCR_BACKOFF_BASE", "2"))
+OCR_BACKOFF_MAX = float(os.environ.get("OCR_BACKOFF_MAX", "60"))
+OCR_TASK_RETRY_DELAY = int(os.environ.get("OCR_TASK_RETRY_DELAY", "30"))
+TRANSIENT_OCR_ERRORS = (
+    openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError,
+    RateLimitTimeout,
+)
+
+# Embed the docs of each upload in a background job once it is saved (see doc_embeddings)
+EMBED_ON_INGEST = os.environ.get("EMBED_ON_INGEST", "true").lower() == "true"
+EMBEDDING_TASK_MAX_RETRIES = int(os.environ.get("EMBEDDING_TASK_MAX_RETRIES", "5"))
+
+# Peak-memory cap for one rendered page (RGB bytes); larger pages render below 300 DPI. 0 disables.
+PDF_RENDER_MAX_BYTES = int(os.environ.get("PDF_RENDER_MAX_BYTES", str(64 * 1024 * 1024)))
 
 class DocumentProcessingError(Exception):
     pass
 
 
 # ---------------- PDF → Image ----------------
-def convert_pdf_to_images(pdf_bytes: bytes, dpi: int = 300):
+def is_image_upload(original_filename):
+    return original_filename.lower().endswith((".jpg", ".png"))
+
+
+def as_stream(binary):
+    """Raw bytes or a stored blob (see blob_store.open_blob) as a readable stream"""
+    if isinstance(binary, (bytes, bytearray)):
+        return BytesIO(binary)
+    binary.seek(0)
+    return binary
+
+
+def page_render_scale(page, dpi: int = 300, max_bytes: int = PDF_RENDER_MAX_BYTES):
+    """Scale for rendering a page at `dpi`, lowered so the RGB bitmap stays under `max_bytes`"""
+    scale = dpi / 72
+    if max_bytes:
+        width, height = page.get_size()
+        rendered_bytes = width * height * scale * scale * 3
+        if rendered_bytes > max_bytes:
+            scale *= (max_bytes / rendered_bytes) ** 0.5
+    return scale
+
+
+def render_pdf_page(pdf, page_index, dpi: int = 300, max_bytes: int = PDF_RENDER_MAX_BYTES):
+    """Render one page to a PIL image, closing the pdfium bitmap and page handles"""
+    page = pdf.get_page(page_index)
+    try:
+        bitmap = page.render(scale=page_render_scale(page, dpi, max_bytes))
+        try:
+            return bitmap.to_pil()  # RGB conversion copies out of the pdfium buffer
+        finally:
+            bitmap.close()
+    finally:
+        page.close()
+
+
+def iter_pdf_images(pdf_bytes, dpi: int = 300, max_bytes: int = PDF_RENDER_MAX_BYTES, skip=()):
+    """
+    Lazily render a PDF one page at a time.
+    Each image is closed when the caller asks for the next page, so only one
+    rendered page is alive at any point regardless of page count.
+    Pages whose 1-based number is in `skip` are not rendered and yield None.
+    """
     pdf = pdfium.PdfDocument(pdf_bytes)
-    return [pdf.get_page(i).render(scale=dpi / 72).to_pil() for i in range(len(pdf))]
+    try:
+        for i in range(len(pdf)):
+            if i + 1 in skip:
+                yield None
+                continue
+            img = render_pdf_page(pdf, i, dpi, max_bytes)
+            try:
+                yield img
+            finally:
+                img.close()
+    finally:
+        pdf.close()
+
 
+def iter_document_images(binary, original_filename, dpi: int = 300, skip=()):
+    """Yield the page images of an upload; image files are a single page"""
+    if is_image_upload(original_filename):
+        if 1 in skip:
+            yield None
+            return
+        with Image.open(as_stream(binary)) as img:
+            yield img.convert("RGB")
+        return
+    yield from iter_pdf_images(binary, dpi, skip=skip)
 
-def image_to_base64(img):
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode()
+
+def convert_pdf_to_images(pdf_bytes: bytes, dpi: int = 300):
+    """Materialize every page; prefer iter_pdf_images for large documents"""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return [render_pdf_page(pdf, i, dpi) for i in range(len(pdf))]
+    finally:
+        pdf.close()
 
 
 # ---------------- Data Cleaning ----------------
@@ -99,6 +240,14 @@ def fix_missing_fields(r):
 
 # ---------------- Stamp Detection ----------------
 def detect_stamps(img):
+    """{"status": YES/NO/N/A, "confidence": 0-1}; the legacy detector has no confidence (None)"""
+    if STAMP_DETECTOR == "fast":
+        return detect_stamp_fast(img)
+    return {"status": detect_stamps_legacy(img), "confidence": None}
+
+
+def detect_stamps_legacy(img):
+    """Full-resolution HSV pass over the whole page"""
     try:
         arr = np.array(img)
         hsv = cv2.cvtColor(arr, cv2.COLOR_RGB2HSV)
@@ -125,28 +274,140 @@ def clean_veh(v):
     return v if re.match(r'^[A-Z]{2}\d{2}[A-Z]{1,3}\d{3,4}$', v) else None
 
 
-def extract_logistics_fields(image, page, stamp):
-    """Call OpenAI OCR"""
-    b64 = image_to_base64(image)
-    system_msg = "You are OCR for cement logistics."
-    prompt = "Return JSON: LR_No, Invoice_No, Vehicle_No, LR_Date, Invoice_Date, Bill_To, Ship_To, Origin, Destination, Principal_Company, Quantity (MT), Doc_Type, Other_Text"
+OCR_SYSTEM_MSG = "You are OCR for cement logistics."
+OCR_PROMPT = "Return JSON: LR_No, Invoice_No, Vehicle_No, LR_Date, Invoice_Date, Bill_To, Ship_To, Origin, Destination, Principal_Company, Quantity (MT), Doc_Type, Other_Text"
+
+OCR_FIELDS = ["LR_No", "Invoice_No", "Vehicle_No", "LR_Date", "Invoice_Date", "Bill_To", "Ship_To",
+              "Origin", "Destination", "Principal_Company", "Quantity", "Doc_Type", "Other_Text"]
+CONFIDENCE_FIELDS = ["LR_No", "Invoice_No", "Vehicle_No", "LR_Date", "Invoice_Date", "Bill_To", "Ship_To"]
+OCR_JSON_SCHEMA = {
+    "name": "logistics_page",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            **{field: {"type": ["string", "null"]} for field in OCR_FIELDS},
+            "Confidence": {
+                "type": "object",
+                "description": "0-1 confidence that each field was read correctly",
+                "properties": {field: {"type": "number"} for field in CONFIDENCE_FIELDS},
+                "required": CONFIDENCE_FIELDS,
+                "additionalProperties": False,
+            },
+        },
+        "required": OCR_FIELDS + ["Confidence"],
+        "additionalProperties": False,
+    },
+}
+
 
-    r = client.chat.completions.create(
-        model="gpt-4o",
+def image_part(encoded):
+    return {"type": "image_url", "image_url": {
+        "url": f"data:{encoded['mime']};base64,{encoded['b64']}",
+        "detail": encoded["detail"],
+    }}
+
+
+def build_ocr_request(encoded, model="gpt-4o"):
+    strict = len(OCR_MODEL_CASCADE) > 1
+    return dict(
+        model=model,
         messages=[
-            {"role": "system", "content": system_msg},
+            {"role": "system", "content": OCR_SYSTEM_MSG},
             {"role": "user", "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}}
+                {"type": "text", "text": OCR_PROMPT + (", Confidence" if strict else "")},
+                image_part(encoded),
             ]}
         ],
-        response_format={"type": "json_object"}
+        response_format={"type": "json_schema", "json_schema": OCR_JSON_SCHEMA} if strict else {"type": "json_object"}
     )
 
+
+def parse_ocr_response(r, encoded, page):
+    """Returns (raw JSON or None, page stats) for a chat completion"""
+    page_stats = {
+        "bytes_sent": encoded["bytes"],
+        "est_image_tokens": encoded["est_image_tokens"],
+        "prompt_tokens": r.usage.prompt_tokens if r.usage else None,
+        "completion_tokens": r.usage.completion_tokens if r.usage else None,
+    }
+    logger.info(f"📤 Page {page}: {page_stats['bytes_sent']} bytes, {page_stats['prompt_tokens']} prompt tokens")
+
     if not r.choices or not r.choices[0].message.content:
+        return None, page_stats
+    return json.loads(r.choices[0].message.content), page_stats
+
+
+def ocr_token_cost(encoded):
+    """Tokens to reserve from the rate limiter for one page request (prompt + image + answer)"""
+    return estimate_tokens(OCR_SYSTEM_MSG + OCR_PROMPT) + encoded["est_image_tokens"] + 400
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given 1-based attempt"""
+    return random.uniform(0, min(OCR_BACKOFF_MAX, OCR_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def with_backoff(call, page):
+    """Run call(), retrying transient OpenAI/rate-limit failures for this page"""
+    for attempt in range(1, OCR_PAGE_MAX_ATTEMPTS + 1):
+        try:
+            return call()
+        except TRANSIENT_OCR_ERRORS as e:
+            if attempt == OCR_PAGE_MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"🔁 Page {page}: {type(e).__name__}, retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def request_ocr(encoded, page, model="gpt-4o"):
+    """Send one encoded page to the vision model; returns (raw JSON or None, page stats)"""
+    def call():
+        acquire(model, ocr_token_cost(encoded), priority="bulk")
+        return client.chat.completions.create(**build_ocr_request(encoded, model))
+    return parse_ocr_response(with_backoff(call, page), encoded, page)
+
+
+def add_page_stats(total, page_stats):
+    """Accumulate stats of successive attempts at the same page"""
+    for key, value in page_stats.items():
+        total[key] = (total.get(key) or 0) + (value or 0)
+    return total
+
+
+def cascade_step(raw, page_stats, stamp, page, level, total_stats):
+    """
+    Map and validate one cascade attempt.
+    Returns the tagged record when it is accepted (or no model is left), otherwise None.
+    """
+    add_page_stats(total_stats, page_stats)
+    model = OCR_MODEL_CASCADE[level]
+    result = map_ocr_fields(raw, stamp)
+    if level < len(OCR_MODEL_CASCADE) - 1:
+        failures = validation_failures(result, raw)
+        if failures:
+            logger.info(f"⬆️ Page {page}: {model} failed validation ({'; '.join(failures)}), escalating")
+            return None
+    total_stats["escalations"] = level
+    return tag_record(result, model, total_stats, raw), raw
+
+
+def run_model_cascade(encoded, page, stamp, start=0, total_stats=None):
+    """Vision tier: returns (record, raw JSON of the accepted model)"""
+    total_stats = {} if total_stats is None else total_stats
+    for level, model in enumerate(OCR_MODEL_CASCADE[start:], start=start):
+        raw, page_stats = request_ocr(encoded, page, model)
+        accepted = cascade_step(raw, page_stats, stamp, page, level, total_stats)
+        if accepted:
+            return accepted
+
+
+def map_ocr_fields(raw, stamp):
+    """Map the model's raw JSON onto record fields"""
+    if not raw:
         return {"Invoice_No": None, "Vehicle_No": None, "LR_No": None, "Order_Type": "BAG"}
 
-    raw = json.loads(r.choices[0].message.content)
     text = raw.get("Other_Text", "")
 
     result = {
@@ -160,125 +421,1047 @@ def extract_logistics_fields(image, page, stamp):
         "Origin": alias(raw, ["Origin", "From"]),
         "Destination": alias(raw, ["Destination", "To"]),
         "Principal_Company": raw.get("Principal_Company") or "Unknown",
-        "Acknowledgement_Status": stamp,
+        "Acknowledgement_Status": stamp["status"],
+        "Acknowledgement_Confidence": stamp["confidence"],
         "Order_Type": "BULK" if "MT" in str(raw.get("Quantity", "")).upper() else "BAG",
         "OTHER": text,
     }
     return result
 
 
+CACHE_HIT_STATS = {"bytes_sent": 0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hit": True}
+LOCAL_TIER_STATS = {"bytes_sent": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def tag_record(result, tier, page_stats, raw=None):
+    result["Extraction_Tier"] = tier
+    result["Page_Stats"] = page_stats
+    result["Raw_OCR"] = raw  # checkpointed with the page so it can be re-mapped without another model call
+    return result
+
+
+def resolve_without_model(image, page, stamp):
+    """
+    Cheap tiers tried before the vision model: the page filter, the page cache, then local OCR.
+    Returns (record or None, perceptual hash to store the model's answer under).
+    """
+    if PAGE_FILTER_MODE in ("flag", "skip"):
+        page_class = classify_page(image)
+        if page_class != "document":
+            logger.info(f"🗑️ Page {page}: looks like a {page_class} page, not sent to OCR")
+            result = tag_record(map_ocr_fields(None, stamp), "filtered", dict(LOCAL_TIER_STATS))
+            result["Page_Filter"] = {"class": page_class, "action": PAGE_FILTER_MODE}
+            return result, None
+
+    page_hash = page_key(image) if PAGE_CACHE_ENABLED else None
+    raw = page_cache.lookup(page_hash) if page_hash else None
+    if raw is not None:
+        logger.info(f"♻️ Page {page}: served from page cache")
+        return tag_record(map_ocr_fields(raw, stamp), "cache", dict(CACHE_HIT_STATS), raw), page_hash
+
+    if LOCAL_OCR_ENABLED:
+        result = extract_local_fields(image, page, stamp)
+        if result is not None:
+            return result, page_hash
+    return None, page_hash
+
+
+def _store_cascade_result(accepted, page_hash):
+    result, raw = accepted
+    if page_hash and raw:
+        page_cache.store(page_hash, raw)
+    return result
+
+
+def extract_logistics_fields(image, page, stamp, profile=None):
+    """Call OpenAI OCR unless a cheaper tier already produced a valid record"""
+    result, page_hash = resolve_without_model(image, page, stamp)
+    if result is not None:
+        return result
+    return _store_cascade_result(run_model_cascade(encode_page_image(image, profile), page, stamp), page_hash)
+
+
+def summarize_page_stats(records):
+    """Total bytes and tokens spent on OCR requests across an upload, and pages per tier"""
+    totals = {"bytes_sent": 0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hits": 0, "tiers": {}, "escalated": 0,
+              "pages_filtered": {}}
+    for record in records:
+        stats = record.get("Page_Stats") or {}
+        for key in ("bytes_sent", "prompt_tokens", "completion_tokens"):
+            totals[key] += stats.get(key) or 0
+        totals["cache_hits"] += 1 if stats.get("cache_hit") else 0
+        tier = record.get("Extraction_Tier", "vision")
+        totals["tiers"][tier] = totals["tiers"].get(tier, 0) + 1
+        totals["escalated"] += 1 if stats.get("escalations") else 0
+        if record.get("Page_Filter"):
+            page_class = record["Page_Filter"]["class"]
+            totals["pages_filtered"][page_class] = totals["pages_filtered"].get(page_class, 0) + 1
+    return totals
+
+
+# ---------------- Local OCR Tier ----------------
+VEHICLE_PATTERN = re.compile(r"\b([A-Z]{2})[ \t-]*(\d{2})[ \t-]*([A-Z]{1,3})[ \t-]*(\d{3,4})\b")
+DOC_NO = r"[ \t]*(?:NO|NUMBER|#)\.?[ \t]*[:\-]?[ \t]*([A-Z0-9][A-Z0-9/\-]*(?: \d[A-Z0-9/\-]*)?)"
+LR_PATTERN = re.compile(r"\b(?:L\.?[ \t]?R|G\.?[ \t]?R|CN|CONSIGNMENT[ \t]+NOTE)\.?" + DOC_NO)
+INVOICE_PATTERN = re.compile(r"\b(?:INVOICE|INV|BILL)\.?" + DOC_NO)
+DATE_TOKEN = r"(\d{1,2}[-./]\d{1,2}[-./]\d{2,4})"
+LR_DATE_PATTERN = re.compile(r"\b(?:L\.?[ \t]?R|G\.?[ \t]?R|CN)\.?[ \t]*DATE[ \t]*[:\-]?[ \t]*" + DATE_TOKEN)
+INVOICE_DATE_PATTERN = re.compile(r"\b(?:INVOICE|INV|BILL)\.?[ \t]*DATE[ \t]*[:\-]?[ \t]*" + DATE_TOKEN)
+ANY_DATE_PATTERN = re.compile(DATE_TOKEN)
+QUANTITY_MT_PATTERN = re.compile(r"\b(\d+(?:\.\d+)?)[ \t]*M\.?T\b")
+PARTY_PATTERNS = {
+    "Bill_To": re.compile(r"^[ \t]*(?:BILL[ \t]*TO|BILLED[ \t]*TO|CONSIGNEE)[ \t]*(?:PARTY)?[ \t]*[:\-][ \t]*(.+)$", re.M | re.I),
+    "Ship_To": re.compile(r"^[ \t]*(?:SHIP[ \t]*TO|SHIPPED[ \t]*TO|DELIVERY[ \t]*(?:AT|ADDRESS)?)[ \t]*(?:PARTY)?[ \t]*[:\-][ \t]*(.+)$", re.M | re.I),
+    "Origin": re.compile(r"^[ \t]*(?:FROM|ORIGIN|DISPATCH[ \t]*FROM)[ \t]*[:\-][ \t]*(.+)$", re.M | re.I),
+    "Destination": re.compile(r"^[ \t]*(?:TO|DESTINATION)[ \t]*[:\-][ \t]*(.+)$", re.M | re.I),
+}
+
+
+def _first_group(pattern, text):
+    m = pattern.search(text)
+    return m.group(1).strip() if m else None
+
+
+def parse_local_text(text):
+    """Regex field extraction over OCR text, shaped like the vision model's raw JSON"""
+    upper = text.upper()
+    vehicle = None
+    for m in VEHICLE_PATTERN.finditer(upper):
+        vehicle = clean_veh("".join(m.groups()))
+        if vehicle:
+            break
+
+    raw = {
+        "LR_No": _first_group(LR_PATTERN, upper),
+        "Invoice_No": _first_group(INVOICE_PATTERN, upper),
+        "Vehicle_No": vehicle,
+        "LR_Date": _first_group(LR_DATE_PATTERN, upper),
+        "Invoice_Date": _first_group(INVOICE_DATE_PATTERN, upper),
+        "Other_Text": text,
+    }
+    if not (raw["LR_Date"] or raw["Invoice_Date"]):
+        # Unlabelled date: attribute it to whichever document number was found
+        date_key = "Invoice_Date" if raw["Invoice_No"] else "LR_Date"
+        raw[date_key] = _first_group(ANY_DATE_PATTERN, upper)
+
+    quantity = _first_group(QUANTITY_MT_PATTERN, upper)
+    if quantity:
+        raw["Quantity"] = f"{quantity} MT"
+    # Party and place names keep their OCR casing; an upper-cased "Navi Mumbai" would read as
+    # a leading code to clean_location and lose its first word
+    for key, pattern in PARTY_PATTERNS.items():
+        value = _first_group(pattern, text)
+        if value:
+            raw[key] = value
+    return raw
+
+
+def extract_local_fields(image, page, stamp):
+    """Tesseract + regex tier. Returns a record, or None when the page must go to the vision model."""
+    try:
+        text = pytesseract.image_to_string(image.convert("L"), timeout=LOCAL_OCR_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"⚠️ Local OCR failed on page {page}, escalating: {e}")
+        return None
+
+    raw = parse_local_text(text)
+    result = map_ocr_fields(raw, stamp)
+    missing = missing_required_fields(result)
+    if missing:
+        logger.info(f"⬆️ Page {page}: local OCR missing {', '.join(missing)}, escalating")
+        return None
+    logger.info(f"🏠 Page {page}: extracted locally")
+    return tag_record(result, "local", dict(LOCAL_TIER_STATS), raw)
+
+
+# ---------------- Validation ----------------
+def missing_required_fields(result):
+    """Required field groups ('A|B' means either) that are absent after normalization"""
+    normalized = normalize_record(dict(result))
+    return [group for group in OCR_REQUIRED_FIELDS
+            if not any(normalized.get(field) for field in group.split("|"))]
+
+
+def validation_failures(result, raw):
+    """Reasons a model's answer should not be trusted; empty when the page passes"""
+    failures = missing_required_fields(result)
+    if not raw:
+        return failures or ["empty response"]
+
+    if raw.get("Vehicle_No") and not result.get("Vehicle_No"):
+        failures.append("Vehicle_No not a valid registration")
+    normalized = normalize_record(dict(result))
+    for date_key in ("LR_Date", "Invoice_Date"):
+        if result.get(date_key) and not normalized.get(date_key):
+            failures.append(f"{date_key} unparseable")
+
+    for field, score in (raw.get("Confidence") or {}).items():
+        if raw.get(field) and isinstance(score, (int, float)) and score < OCR_MIN_FIELD_CONFIDENCE:
+            failures.append(f"{field} confidence {score:.2f}")
+    return failures
+
+
+# ---------------- Async OCR Executor ----------------
+def get_event_loop():
+    """One event loop per worker process, so the AsyncOpenAI connection pool is reused across tasks"""
+    global _event_loop
+    if _event_loop is None or _event_loop.is_closed():
+        _event_loop = asyncio.new_event_loop()
+    return _event_loop
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _async_client
+
+
+async def with_backoff_async(call, page):
+    for attempt in range(1, OCR_PAGE_MAX_ATTEMPTS + 1):
+        try:
+            return await call()
+        except TRANSIENT_OCR_ERRORS as e:
+            if attempt == OCR_PAGE_MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"🔁 Page {page}: {type(e).__name__}, retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def request_ocr_async(encoded, page, model="gpt-4o"):
+    async def call():
+        await acquire_async(model, ocr_token_cost(encoded), priority="bulk")
+        return await get_async_client().chat.completions.create(**build_ocr_request(encoded, model))
+    return parse_ocr_response(await with_backoff_async(call, page), encoded, page)
+
+
+async def run_model_cascade_async(encoded, page, stamp):
+    total_stats = {}
+    for level, model in enumerate(OCR_MODEL_CASCADE):
+        raw, page_stats = await request_ocr_async(encoded, page, model)
+        accepted = cascade_step(raw, page_stats, stamp, page, level, total_stats)
+        if accepted:
+            return accepted
+
+
+def _prepare_next_page(pages, profile):
+    """CPU half of a page: stamp detection, cheap tiers and encoding. None when pages run out."""
+    try:
+        page_no, img = next(pages)
+    except StopIteration:
+        return None
+    stamp = detect_stamps(img)
+    result, page_hash = resolve_without_model(img, page_no, stamp)
+    encoded = encode_page_image(img, profile) if result is None else None
+    return page_no, stamp, page_hash, result, encoded
+
+
+async def _finish_page(prepared, semaphore, on_page):
+    page_no, stamp, page_hash, result, encoded = prepared
+    try:
+        if result is None:
+            result = _store_cascade_result(await run_model_cascade_async(encoded, page_no, stamp), page_hash)
+    finally:
+        semaphore.release()
+
+    record = fix_missing_fields(normalize_record(result))
+    if on_page:
+        on_page(page_no, record)
+    return record
+
+
+async def _ocr_pages(pages, profile, on_page):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(OCR_MAX_IN_FLIGHT)
+    in_flight = []
+    try:
+        while True:
+            # Rendering runs in a thread so in-flight requests keep progressing meanwhile
+            prepared = await loop.run_in_executor(None, _prepare_next_page, pages, profile)
+            if prepared is None:
+                break
+            await semaphore.acquire()  # never render further ahead than the in-flight limit
+            in_flight.append(asyncio.create_task(_finish_page(prepared, semaphore, on_page)))
+        return await asyncio.gather(*in_flight)
+    except BaseException:
+        for task in in_flight:
+            task.cancel()
+        raise
+
+
+def ocr_pages_async(pages, profile=None, on_page=None):
+    """
+    OCR an iterator of (page_no, image) with up to OCR_MAX_IN_FLIGHT concurrent model calls.
+    on_page(page_no, record) runs as each page completes. Returns normalized records in page order.
+    """
+    return get_event_loop().run_until_complete(_ocr_pages(iter(pages), profile, on_page))
+
+
+# ---------------- Batched OCR ----------------
+OCR_BATCH_PROMPT = (
+    "Each image is one page; the text before it gives its page number. "
+    'Return JSON {"pages": [...]} with one object per page holding "Page" (the page number) and: '
+)
+
+
+def build_batch_ocr_request(batch, model="gpt-4o"):
+    """One request for several pages; batch is a list of (page_no, encoded)"""
+    strict = len(OCR_MODEL_CASCADE) > 1
+    content = [{"type": "text", "text": OCR_BATCH_PROMPT + OCR_PROMPT.split(": ", 1)[1] + (", Confidence" if strict else "")}]
+    for page_no, encoded in batch:
+        content += [{"type": "text", "text": f"Page {page_no}:"}, image_part(encoded)]
+
+    if strict:
+        page_schema = OCR_JSON_SCHEMA["schema"]
+        item = {**page_schema, "properties": {"Page": {"type": "integer"}, **page_schema["properties"]},
+                "required": ["Page"] + page_schema["required"]}
+        response_format = {"type": "json_schema", "json_schema": {
+            "name": "logistics_pages", "strict": True,
+            "schema": {"type": "object", "properties": {"pages": {"type": "array", "items": item}},
+                       "required": ["pages"], "additionalProperties": False},
+        }}
+    else:
+        response_format = {"type": "json_object"}
+
+    return dict(
+        model=model,
+        messages=[{"role": "system", "content": OCR_SYSTEM_MSG}, {"role": "user", "content": content}],
+        response_format=response_format,
+    )
+
+
+def parse_batch_ocr_response(r, batch):
+    """
+    Split a batched completion into {page_no: (raw JSON, page stats)}.
+    Pages the model left out are missing from the result; an unparseable answer yields {}.
+    """
+    usage_share = 1.0 / len(batch)
+    prompt_tokens = r.usage.prompt_tokens if r.usage else None
+    completion_tokens = r.usage.completion_tokens if r.usage else None
+    logger.info(f"📤 Pages {batch[0][0]}-{batch[-1][0]}: {sum(e['bytes'] for _, e in batch)} bytes, "
+                f"{prompt_tokens} prompt tokens")
+
+    try:
+        answer = json.loads(r.choices[0].message.content)
+        by_page = {int(item["Page"]): item for item in answer["pages"]}
+    except (IndexError, TypeError, KeyError, ValueError) as e:
+        logger.warning(f"⚠️ Batch of {len(batch)} pages returned unusable JSON: {e}")
+        return {}
+
+    results = {}
+    for page_no, encoded in batch:
+        if page_no not in by_page:
+            continue
+        results[page_no] = (by_page[page_no], {
+            "bytes_sent": encoded["bytes"],
+            "est_image_tokens": encoded["est_image_tokens"],
+            "prompt_tokens": round(prompt_tokens * usage_share) if prompt_tokens else None,
+            "completion_tokens": round(completion_tokens * usage_share) if completion_tokens else None,
+            "batch_size": len(batch),
+        })
+    return results
+
+
+def batch_token_cost(batch):
+    return estimate_tokens(OCR_SYSTEM_MSG + OCR_BATCH_PROMPT + OCR_PROMPT) + sum(
+        encoded["est_image_tokens"] + 400 for _, encoded in batch
+    )
+
+
+def extract_logistics_fields_batch(batch):
+    """
+    Vision tier for several pages in one request; batch is a list of (page_no, stamp, page_hash, encoded).
+    Pages missing from the answer, or the whole batch when it does not parse, fall back to
+    per-page requests. Returns {page_no: record}.
+    """
+    if len(batch) == 1:
+        page_no, stamp, page_hash, encoded = batch[0]
+        return {page_no: _store_cascade_result(run_model_cascade(encoded, page_no, stamp), page_hash)}
+
+    model = OCR_MODEL_CASCADE[0]
+    payload = [(page_no, encoded) for page_no, _, _, encoded in batch]
+
+    def call():
+        acquire(model, batch_token_cost(payload), priority="bulk")
+        return client.chat.completions.create(**build_batch_ocr_request(payload, model))
+    answers = parse_batch_ocr_response(with_backoff(call, batch[0][0]), payload)
+
+    records = {}
+    for page_no, stamp, page_hash, encoded in batch:
+        if page_no not in answers:
+            logger.info(f"↩️ Page {page_no}: not in batch answer, retrying on its own")
+            records[page_no] = _store_cascade_result(run_model_cascade(encoded, page_no, stamp), page_hash)
+            continue
+        raw, page_stats = answers[page_no]
+        total_stats = {}
+        accepted = cascade_step(raw, page_stats, stamp, page_no, 0, total_stats)
+        if not accepted:
+            accepted = run_model_cascade(encoded, page_no, stamp, start=1, total_stats=total_stats)
+        records[page_no] = _store_cascade_result(accepted, page_hash)
+    return records
+
+
+def batch_has_room(batch, encoded):
+    pages = [e for _, _, _, e in batch] + [encoded]
+    return (len(pages) <= OCR_BATCH_MAX_PAGES
+            and sum(e["est_image_tokens"] for e in pages) <= OCR_BATCH_TOKEN_BUDGET
+            and sum(e["bytes"] for e in pages) <= OCR_BATCH_MAX_BYTES)
+
+
+def ocr_pages_batched(pages, profile=None, on_page=None):
+    """
+    OCR an iterator of (page_no, image), packing pages that need the vision model into
+    batched requests sized by OCR_BATCH_MAX_PAGES / OCR_BATCH_TOKEN_BUDGET / OCR_BATCH_MAX_BYTES.
+    Only the encoded payload of a pending page is kept, so rendered images are released early.
+    on_page(page_no, record) runs as each page completes. Returns normalized records in page order.
+    """
+    records, batch = {}, []
+
+    def finish(page_no, result):
+        records[page_no] = fix_missing_fields(normalize_record(result))
+        if on_page:
+            on_page(page_no, records[page_no])
+
+    def flush():
+        for page_no, result in sorted(extract_logistics_fields_batch(batch).items()):
+            finish(page_no, result)
+        batch.clear()
+
+    for page_no, img in pages:
+        stamp = detect_stamps(img)
+        result, page_hash = resolve_without_model(img, page_no, stamp)
+        if result is not None:
+            finish(page_no, result)
+            continue
+        encoded = encode_page_image(img, profile)
+        if batch and not batch_has_room(batch, encoded):
+            flush()
+        batch.append((page_no, stamp, page_hash, encoded))
+    if batch:
+        flush()
+
+    return [records[page_no] for page_no in sorted(records)]
+
+
 # ---------------- Utility ----------------
 def compute_file_hash(binary_data: bytes) -> str:
+    """SHA-256 of an upload; also the key it is stored under in blob_store"""
     return hashlib.sha256(binary_data).hexdigest()
 
 
+# ---------------- Page Pipeline ----------------
+def count_pages(binary, original_filename):
+    if is_image_upload(original_filename):
+        return 1
+    pdf = pdfium.PdfDocument(binary)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def render_page(binary, original_filename, page_index, dpi: int = 300):
+    """Render a single page of an upload (images are treated as one page)"""
+    if is_image_upload(original_filename):
+        with Image.open(as_stream(binary)) as img:
+            return img.convert("RGB")
+    pdf = pdfium.PdfDocument(binary)
+    try:
+        return render_pdf_page(pdf, page_index, dpi)
+    finally:
+        pdf.close()
+
+
+def process_page(img, page_no):
+    r = extract_logistics_fields(img, page_no, detect_stamps(img))
+    return fix_missing_fields(normalize_record(r))
+
+
+# ---------------- Persistence ----------------
+def trip_key_for(record):
+    """(trip_id, truck_no, order_no) a record links to, or None when it cannot be linked"""
+    vehicle_no = record.get("Vehicle_No")
+    invoice_no = record.get("Invoice_No") or record.get("LR_No")
+    if not (vehicle_no and invoice_no):
+        return None
+    return f"SHIP-{vehicle_no}-{invoice_no}", vehicle_no, invoice_no
+
+
+def doc_row(record, upload_id):
+    raw_data = record.get("OTHER")
+    raw_text_value = json.dumps(raw_data) if isinstance(raw_data, dict) else str(raw_data or "")
+    trip_key = trip_key_for(record)
+    page_filter = record.get("Page_Filter")
+
+    return {
+        "upload_id": upload_id,
+        "page_no": record.get("Page_No"),
+        "doc_category": "BAG",
+        "invoice_no": record.get("Invoice_No"),
+        "invoice_date": record.get("Invoice_Date"),
+        "lr_no": record.get("LR_No"),
+        "lr_date": record.get("LR_Date"),
+        "truck_no": record.get("Vehicle_No"),
+        "principal_company": record.get("Principal_Company"),
+        "origin": record.get("Origin"),
+        "destination": record.get("Destination"),
+        "order_type": record.get("Order_Type"),
+        "acknowledgement_status": record.get("Acknowledgement_Status"),
+        "bill_to_party": record.get("Bill_To_Party"),
+        "ship_to_party": record.get("Ship_To_Party"),
+        "raw_text": raw_text_value,
+        "validation_status": f"Flagged_{page_filter['class']}" if page_filter else "Pending",
+        "is_linked": trip_key is not None,
+        "link_reason": f"Linked to {trip_key[0]}" if trip_key else "Missing Truck/Invoice",
+    }
+
+
+def upsert_trips(db_session, trip_keys):
+    """
+    Create missing trips and return {trip_id: LinkedTrip.id} for every key in one statement.
+    trip_id is unique, so concurrent workers linking the same truck/invoice converge on one row.
+    """
+    if not trip_keys:
+        return {}
+    now = datetime.now()
+    stmt = pg_insert(LinkedTrip).values([
+        {"trip_id": trip_id, "order_no": order_no, "truck_no": truck_no,
+         "order_date": now, "order_time": now, "status": "Linked"}
+        for trip_id, truck_no, order_no in sorted(trip_keys)  # stable order avoids lock-order deadlocks
+    ])
+    # The no-op update makes RETURNING include trips that already existed
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LinkedTrip.trip_id], set_={"trip_id": stmt.excluded.trip_id}
+    ).returning(LinkedTrip.trip_id, LinkedTrip.id)
+    return {trip_id: pk for trip_id, pk in db_session.execute(stmt)}
+
+
+def link_docs(db_session, doc_keys):
+    """Link docs to their trips; doc_keys is a list of (doc_id, trip key or None)"""
+    links = [(doc_id, key) for doc_id, key in doc_keys if key]
+    trip_pks = upsert_trips(db_session, {key for _, key in links})
+    logger.info(f"🔗 Linked {len(links)} docs to {len(trip_pks)} trips")
+
+    if links:
+        now = datetime.now()
+        db_session.execute(insert(TripDocument), [
+            {"trip_id": trip_pks[key[0]], "doc_id": doc_id, "doc_role": "Invoice"} for doc_id, key in links
+        ])
+        db_session.execute(insert(WeighmentSlip), [
+            {"doc_id": doc_id, "vehicle_no": key[1], "gross_weight": None, "tare_weight": None,
+             "net_weight": None, "slip_date": now}
+            for doc_id, key in links
+        ])
+
+
+def save_records(db_session, records, upload_metadata):
+    """
+    Persist extracted docs and trip links for one upload and mark it Completed.
+    Issues a fixed number of statements regardless of page count.
+    Returns None without saving anything when another run already completed the upload.
+    """
+    # Claim the upload in the same transaction as the inserts: a concurrent run blocks on the
+    # row lock, then finds it Completed and gets no row back
+    claimed = db_session.execute(
+        update(UploadMetadata)
+        .where(UploadMetadata.id == upload_metadata.id, UploadMetadata.upload_status.in_(UNFINISHED_STATUSES))
+        .values(upload_status="Completed")
+        .returning(UploadMetadata.id)
+    ).first()
+    if claimed is None:
+        db_session.rollback()
+        return None
+
+    # Pages the filter dropped get no ExtractedDocs row; flagged ones are kept for review
+    records = [r for r in records if (r.get("Page_Filter") or {}).get("action") != "skip"]
+
+    if records:
+        doc_ids = db_session.execute(
+            insert(ExtractedDocs).returning(ExtractedDocs.id, sort_by_parameter_order=True),
+            [doc_row(record, upload_metadata.id) for record in records],
+        ).scalars().all()
+
+        link_docs(db_session, [(doc_id, trip_key_for(record)) for doc_id, record in zip(doc_ids, records)])
+
+    db_session.commit()
+    return upload_metadata
+
+
+# ---------------- Checkpoints ----------------
+def start_upload(db_session, original_filename, file_hash):
+    """
+    The UploadMetadata row for a file, created as Processing on first sight.
+    A retried or resubmitted upload gets its existing row back, with its checkpoints.
+    """
+    db_session.execute(pg_insert(UploadMetadata).values(
+        file_name=original_filename, doc_type="pdf", file_path=blob_path(file_hash),
+        uploaded_by="system", file_hash=file_hash, upload_status="Processing",
+    ).on_conflict_do_nothing(index_elements=[UploadMetadata.file_hash]))
+    upload_metadata = db_session.query(UploadMetadata).filter_by(file_hash=file_hash).one()
+    if upload_metadata.upload_status == "Failed":
+        upload_metadata.retry_count = 0  # a resubmitted upload gets a fresh retry budget
+    if upload_metadata.upload_status in UNFINISHED_STATUSES:
+        upload_metadata.upload_status = "Processing"
+    db_session.commit()
+    return upload_metadata
+
+
+def load_checkpoints(db_session, upload_id, page_nos=None):
+    """{page_no: record} for pages of an upload whose OCR already finished"""
+    query = db_session.query(ExtractedPage.page_no, ExtractedPage.raw_text).filter_by(upload_id=upload_id)
+    if page_nos is not None:
+        query = query.filter(ExtractedPage.page_no.in_(page_nos))
+    return {page_no: json.loads(raw_text) for page_no, raw_text in query}
+
+
+def checkpoint_page(db_session, upload_id, page_no, record):
+    """Store one page's finished record (including the raw OCR JSON) as soon as it returns"""
+    record["Page_No"] = page_no  # ties the ExtractedDocs row back to this checkpoint for replays
+    confidence = (record.get("Raw_OCR") or {}).get("Confidence") or {}
+    scores = [v for v in confidence.values() if isinstance(v, (int, float))]
+    db_session.execute(pg_insert(ExtractedPage).values(
+        upload_id=upload_id, page_no=page_no,
+        invoice_no=record.get("Invoice_No"), lr_no=record.get("LR_No"), truck_no=record.get("Vehicle_No"),
+        bill_to_party=record.get("Bill_To_Party"), ship_to_party=record.get("Ship_To_Party"),
+        extraction_confidence=min(scores) if scores else None,
+        raw_text=json.dumps(record),
+        is_flagged=bool(record.get("Page_Filter")),
+    ).on_conflict_do_nothing(index_elements=[ExtractedPage.upload_id, ExtractedPage.page_no]))
+    db_session.commit()
+
+
+# ---------------- Replay ----------------
+# Columns a replay may rewrite; validation_status and manual corrections are left alone
+REPLAY_COLUMNS = [
+    "invoice_no", "invoice_date", "lr_no", "lr_date", "truck_no", "principal_company", "origin",
+    "destination", "order_type", "acknowledgement_status", "bill_to_party", "ship_to_party",
+    "raw_text", "is_linked", "link_reason",
+]
+
+
+def replay_record(checkpoint):
+    """Re-run mapping, normalization and field fixes on a checkpointed page. None if it has no raw output."""
+    stamp = {"status": checkpoint.get("Acknowledgement_Status"),
+             "confidence": checkpoint.get("Acknowledgement_Confidence")}
+    if checkpoint.get("Page_Filter"):
+        result = map_ocr_fields(None, stamp)
+        result["Page_Filter"] = checkpoint["Page_Filter"]
+    elif checkpoint.get("Raw_OCR") is not None:
+        result = map_ocr_fields(checkpoint["Raw_OCR"], stamp)
+    else:
+        return None
+    return fix_missing_fields(normalize_record(result))
+
+
+def _comparable(value):
+    return value.strftime("%Y-%m-%d") if isinstance(value, datetime) else value
+
+
+def _replay_chunk(db_session, rows, dry_run, summary):
+    updates, relinks = [], []
+    for page, doc in rows:
+        record = replay_record(json.loads(page.raw_text))
+        if record is None:
+            summary["no_raw_output"] += 1
+            continue
+        new = doc_row(record, doc.upload_id)
+        changes = {col: new[col] for col in REPLAY_COLUMNS if _comparable(getattr(doc, col)) != new[col]}
+        if not changes:
+            continue
+
+        summary["changed"] += 1
+        for col in changes:
+            summary["fields"][col] = summary["fields"].get(col, 0) + 1
+        if len(summary["samples"]) < summary["max_samples"]:
+            summary["samples"].append({
+                "doc_id": doc.id, "upload_id": doc.upload_id, "page_no": doc.page_no,
+                "changes": {col: [_comparable(getattr(doc, col)), value] for col, value in changes.items()},
+            })
+        updates.append({"id": doc.id, **changes})
+        if trip_key_for(record) != _current_trip_key(doc):
+            relinks.append((doc.id, trip_key_for(record)))
+
+    summary["relinked"] += len(relinks)
+    if dry_run or not updates:
+        return
+
+    db_session.execute(update(ExtractedDocs), updates)
+    if relinks:
+        doc_ids = [doc_id for doc_id, _ in relinks]
+        old_trips = set(db_session.scalars(select(TripDocument.trip_id).where(TripDocument.doc_id.in_(doc_ids))))
+        db_session.execute(delete(TripDocument).where(TripDocument.doc_id.in_(doc_ids)))
+        db_session.execute(delete(WeighmentSlip).where(WeighmentSlip.doc_id.in_(doc_ids)))
+        link_docs(db_session, relinks)
+        # Trips that lost their last document were only created by the old linking rules
+        if old_trips:
+            db_session.execute(delete(LinkedTrip).where(
+                LinkedTrip.id.in_(old_trips), ~LinkedTrip.documents.any()
+            ))
+    db_session.commit()
+
+
+def _current_trip_key(doc):
+    return trip_key_for({"Vehicle_No": doc.truck_no, "Invoice_No": doc.invoice_no, "LR_No": doc.lr_no})
+
+
+def replay_extractions(db_session, dry_run=False, upload_ids=None, chunk_size=500, max_samples=50):
+    """
+    Rebuild ExtractedDocs and trip links from checkpointed raw OCR output without calling any model.
+    Pages are streamed in keyset-paginated chunks, each updated and committed in bulk.
+    Docs with a manual correction are skipped. With dry_run nothing is written.
+    """
+    summary = {"pages": 0, "changed": 0, "relinked": 0, "no_raw_output": 0, "skipped_manual": 0,
+               "fields": {}, "samples": [], "max_samples": max_samples, "dry_run": dry_run}
+    query = (
+        select(ExtractedPage, ExtractedDocs)
+        .join(ExtractedDocs, (ExtractedDocs.upload_id == ExtractedPage.upload_id)
+              & (ExtractedDocs.page_no == ExtractedPage.page_no))
+        .order_by(ExtractedPage.id)
+        .limit(chunk_size)
+    )
+    if upload_ids:
+        query = query.where(ExtractedPage.upload_id.in_(upload_ids))
+
+    last_id = 0
+    while True:
+        rows = db_session.execute(query.where(ExtractedPage.id > last_id)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+        summary["pages"] += len(rows)
+        editable = [(page, doc) for page, doc in rows if doc.last_validated_at is None]
+        summary["skipped_manual"] += len(rows) - len(editable)
+        _replay_chunk(db_session, editable, dry_run, summary)
+        db_session.expunge_all()
+        logger.info(f"♻️ Replayed {summary['pages']} pages, {summary['changed']} docs changed")
+
+    del summary["max_samples"]
+    return summary
+
+
 # ---------------- Celery Task ----------------
+def elapsed_ms(since):
+    return int((time.monotonic() - since) * 1000)
+
+
+def finish_upload(file_hash, completed):
+    """Dedup bookkeeping, then free the upload's fair-scheduler slot and backlog pages"""
+    settle_upload(file_hash, completed)
+    fair_scheduler.release(file_hash)
+    admission.finish(file_hash)
+
+
+def skip_duplicate(file_hash, original_filename, progress_id):
+    logger.warning(f"⚠️ Duplicate file detected: {original_filename}")
+    finish_upload(file_hash, completed=True)
+    result = {"status": "SKIPPED", "reason": "Duplicate file"}
+    progress_events.publish(progress_id, {"type": "complete", **result})  # ends the client's stream
+    return result
+
+
+def queue_embeddings(upload_id):
+    """Embed a saved upload's docs in the background; a broker hiccup must not fail the upload"""
+    if not EMBED_ON_INGEST:
+        return
+    try:
+        generate_embeddings_task.apply_async(kwargs={"upload_ids": [upload_id]})
+    except Exception as e:
+        logger.warning(f"⚠️ Could not queue embeddings for upload {upload_id}: {e}")
+
+
+def fail_upload(db_session, upload_metadata, file_hash, error):
+    db_session.rollback()
+    if upload_metadata is not None:
+        try:
+            upload_metadata.upload_status = "Failed"
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+    finish_upload(file_hash, completed=False)
+    logger.error(f"❌ Document processing failed: {error}")
+
+
 @app.task(bind=True, name="process_document")
-def process_document_task(self, file_content_b64, original_filename):
+def process_document_task(self, file_hash, original_filename):
     db_session = SessionLocal()
-    final_records_with_id = []
+    fan_out = None
+    upload_metadata = None
 
     try:
-        binary = base64.b64decode(file_content_b64)
-        file_hash = compute_file_hash(binary)
-        logger.info(f"🔍 Computed file hash for {original_filename}: {file_hash}")
-
-        # Avoid duplicate uploads
-        if db_session.query(UploadMetadata).filter_by(file_hash=file_hash).first():
-            logger.warning(f"⚠️ Duplicate file detected: {original_filename}")
-            return {"status": "SKIPPED", "reason": "Duplicate file"}
-
-        imgs = [Image.open(BytesIO(binary)).convert("RGB")] if original_filename.lower().endswith((".jpg", ".png")) else convert_pdf_to_images(binary)
-        records = []
-        for i, img in enumerate(imgs):
-            self.update_state(state='PROGRESS', meta={"page": i + 1})
-            r = extract_logistics_fields(img, i + 1, detect_stamps(img))
-            records.append(fix_missing_fields(normalize_record(r)))
-
-        # Save Upload Info
-        upload_metadata = UploadMetadata(
-            file_name=original_filename, doc_type="pdf",
-            file_path=f"uploads/{original_filename}", uploaded_by="system", file_hash=file_hash
-        )
-        db_session.add(upload_metadata)
-        db_session.commit()
+        logger.info(f"🔍 Processing {original_filename} ({file_hash})")
 
-        # Process records
-        for record in records:
-            raw_data = record.get("OTHER")
-            raw_text_value = json.dumps(raw_data) if isinstance(raw_data, dict) else str(raw_data or "")
-
-            extracted_doc = ExtractedDocs(
-                upload_id=upload_metadata.id,
-                doc_category="BAG",
-                invoice_no=record.get("Invoice_No"),
-                invoice_date=record.get("Invoice_Date"),
-                lr_no=record.get("LR_No"),
-                lr_date=record.get("LR_Date"),
-                truck_no=record.get("Vehicle_No"),
-                principal_company=record.get("Principal_Company"),
-                origin=record.get("Origin"),
-                destination=record.get("Destination"),
-                order_type=record.get("Order_Type"),
-                acknowledgement_status=record.get("Acknowledgement_Status"),
-                bill_to_party=record.get("Bill_To_Party"),
-                ship_to_party=record.get("Ship_To_Party"),
-                raw_text=raw_text_value,
-                validation_status="Pending",
-            )
-            db_session.add(extracted_doc)
-            db_session.flush()
-
-            vehicle_no = record.get("Vehicle_No")
-            invoice_no = record.get("Invoice_No") or record.get("LR_No")
-            if not (vehicle_no and invoice_no):
-                extracted_doc.is_linked = False
-                extracted_doc.link_reason = "Missing Truck/Invoice"
-                continue
+        # Avoid duplicate uploads; unfinished ones resume from their checkpoints
+        existing = db_session.query(UploadMetadata).filter_by(file_hash=file_hash).first()
+        if existing and existing.upload_status not in UNFINISHED_STATUSES:
+            return skip_duplicate(file_hash, original_filename, self.request.id)
+
+        started = time.monotonic()
+        upload_metadata = start_upload(db_session, original_filename, file_hash)
+        finished = load_checkpoints(db_session, upload_metadata.id)
+        resumed = len(finished)
+        if resumed:
+            logger.info(f"⏩ Resuming {original_filename}: {resumed} pages already checkpointed")
 
-            # ✅ FIX: Check existing trip before creating new one
-            existing_trip = db_session.query(LinkedTrip).filter_by(
-                truck_no=vehicle_no,
-                order_no=invoice_no
-            ).first()
+        def on_page(page_no, record):
+            checkpoint_page(db_session, upload_metadata.id, page_no, record)
+            finished[page_no] = record
+            self.update_state(state='PROGRESS', meta={
+                "page": page_no, "progress": {"current": len(finished), "total": page_count}
+            })
+            progress_events.publish_page(self.request.id, page_no, page_count, tier=record.get("Extraction_Tier"),
+                                         elapsed_ms=elapsed_ms(started))
 
-            if existing_trip:
-                logger.info(f"♻️ Existing trip found for {vehicle_no}-{invoice_no}")
-                trip_id_to_use = existing_trip.id
+        with open_blob(file_hash) as binary:
+            page_count = count_pages(binary, original_filename)
+            progress_events.reset(self.request.id, done=resumed)
+            progress_events.publish(self.request.id, {
+                "type": "started", "total": page_count, "resumed": resumed, "executor": OCR_EXECUTOR,
+                "current": resumed,
+            })
+            progress = {"progress_id": self.request.id, "page_total": page_count}
+            if OCR_EXECUTOR == "staged":
+                # Render/encode on the CPU pool, then OCR on the IO pool; pages travel as spool references
+                fan_out = chord(
+                    [chain(prepare_page_task.s(file_hash, original_filename, i, upload_metadata.id),
+                           ocr_page_task.s(file_hash, upload_metadata.id, **progress))
+                     for i in range(page_count)],
+                    finalize_document_task.s(original_filename, file_hash, upload_metadata.id),
+                )
+            elif OCR_FANOUT and page_count >= OCR_FANOUT_MIN_PAGES:
+                # Pages are OCR'd concurrently; finalize_document persists once all are back
+                fan_out = chord(
+                    [process_page_task.s(file_hash, original_filename, i, upload_metadata.id, **progress)
+                     for i in range(page_count)],
+                    finalize_document_task.s(original_filename, file_hash, upload_metadata.id),
+                )
             else:
-                logger.info(f"🚀 Creating new trip for {vehicle_no}-{invoice_no}")
-                new_trip = LinkedTrip(
-                    order_no=invoice_no,
-                    trip_id=f"SHIP-{vehicle_no}-{invoice_no}",
-                    order_date=datetime.now(),
-                    order_time=datetime.now(),
-                    truck_no=vehicle_no,
-                    status="Linked"
+                # Pages are rendered lazily and released as soon as their OCR returns;
+                # checkpointed pages are neither rendered nor OCR'd again
+                pages = (
+                    (page_no, img)
+                    for page_no, img in enumerate(iter_document_images(binary, original_filename, skip=finished), start=1)
+                    if page_no not in finished
                 )
-                db_session.add(new_trip)
-                db_session.flush()
-                trip_id_to_use = new_trip.id
-
-            db_session.add(TripDocument(trip_id=trip_id_to_use, doc_id=extracted_doc.id, doc_role="Invoice"))
-            extracted_doc.is_linked = True
-            extracted_doc.link_reason = f"Linked to SHIP-{vehicle_no}-{invoice_no}"
-
-            db_session.add(WeighmentSlip(
-                doc_id=extracted_doc.id,
-                vehicle_no=vehicle_no,
-                gross_weight=None,
-                tare_weight=None,
-                net_weight=None,
-                slip_date=datetime.now()
-            ))
+                pages_started = time.monotonic()
+                if OCR_EXECUTOR == "async":
+                    ocr_pages_async(pages, on_page=on_page)
+                elif OCR_BATCH_MAX_PAGES > 1:
+                    ocr_pages_batched(pages, on_page=on_page)
+                else:
+                    for page_no, img in pages:
+                        on_page(page_no, process_page(img, page_no))
+                timings = {"prepare_ms": int((pages_started - started) * 1000), "pages_ms": elapsed_ms(pages_started)}
 
+                save_started = time.monotonic()
+                records = [finished[page_no] for page_no in sorted(finished)]
+                if save_records(db_session, records, upload_metadata) is None:
+                    return skip_duplicate(file_hash, original_filename, self.request.id)
+                finish_upload(file_hash, completed=True)
+                queue_embeddings(upload_metadata.id)
+                timings.update(save_ms=elapsed_ms(save_started), total_ms=elapsed_ms(started))
+                logger.info(f"✅ All records for {original_filename} processed successfully.")
+                result = {"status": "SUCCESS", "records_processed": len(records), "pages_resumed": resumed,
+                          "ocr_usage": summarize_page_stats(records), "timings_ms": timings}
+                progress_events.publish(self.request.id, {"type": "complete", "current": page_count,
+                                                          "total": page_count, **result})
+                return result
+
+    except TRANSIENT_OCR_ERRORS as e:
+        db_session.rollback()
+        if upload_metadata is None or upload_metadata.retry_count >= upload_metadata.max_retries:
+            fail_upload(db_session, upload_metadata, file_hash, e)
+            raise DocumentProcessingError(str(e))
+        upload_metadata.retry_count += 1
+        upload_metadata.upload_status = "Retrying"
         db_session.commit()
+        countdown = OCR_TASK_RETRY_DELAY * 2 ** (upload_metadata.retry_count - 1)
+        logger.warning(f"🔁 {original_filename}: {type(e).__name__}, retry "
+                       f"{upload_metadata.retry_count}/{upload_metadata.max_retries} in {countdown}s")
+        progress_events.publish(self.request.id, {"type": "retrying", "attempt": upload_metadata.retry_count,
+                                                  "countdown": countdown, "error": str(e)})
+        raise self.retry(exc=e, countdown=countdown, max_retries=None)
+    except Exception as e:
+        fail_upload(db_session, upload_metadata, file_hash, e)
+        progress_events.publish(self.request.id, {"type": "failed", "error": str(e)})
+        raise DocumentProcessingError(str(e))
+    finally:
+        db_session.close()
+
+    # replace() hands this task id over to the chord, so status polling keeps working
+    logger.info(f"🔀 Fanning out {page_count} pages of {original_filename}")
+    return self.replace(fan_out)
+
+
+@app.task(bind=True, name="process_page")
+def process_page_task(self, file_hash, original_filename, page_index, upload_id, progress_id=None, page_total=None):
+    db_session = SessionLocal()
+    page_no = page_index + 1
+    try:
+        checkpoint = load_checkpoints(db_session, upload_id, [page_no])
+        if checkpoint:
+            return checkpoint[page_no]
+        with open_blob(file_hash) as binary:
+            img = render_page(binary, original_filename, page_index)
+        record = process_page(img, page_no)
+        checkpoint_page(db_session, upload_id, page_no, record)
+        progress_events.publish_page(progress_id, page_no, page_total, tier=record.get("Extraction_Tier"))
+        return record
+    except TRANSIENT_OCR_ERRORS as e:
+        retry_page_task(self, db_session, upload_id, file_hash, page_no, e, progress_id)
+    except Exception as e:
+        fail_upload(db_session, db_session.get(UploadMetadata, upload_id), file_hash, e)
+        progress_events.publish(progress_id, {"type": "failed", "page": page_no, "error": str(e)})
+        logger.error(f"❌ Page {page_no} of {original_filename} failed: {e}")
+        raise DocumentProcessingError(str(e))
+    finally:
+        db_session.close()
+
+
+@app.task(name="prepare_page")
+def prepare_page_task(file_hash, original_filename, page_index, upload_id):
+    """
+    CPU stage of a page: render, stamp detection, cheap tiers and encoding.
+    Returns the finished record when no model call is needed, otherwise a spool reference for ocr_page.
+    """
+    db_session = SessionLocal()
+    page_no = page_index + 1
+    try:
+        checkpoint = load_checkpoints(db_session, upload_id, [page_no])
+        if checkpoint:
+            return {"page_no": page_no, "record": checkpoint[page_no], "resumed": True}
+
+        with open_blob(file_hash) as binary:
+            img = render_page(binary, original_filename, page_index)
+        try:
+            stamp = detect_stamps(img)
+            result, page_hash = resolve_without_model(img, page_no, stamp)
+            if result is not None:
+                record = fix_missing_fields(normalize_record(result))
+                checkpoint_page(db_session, upload_id, page_no, record)
+                return {"page_no": page_no, "record": record}
+            encoded = encode_page_image(img)
+        finally:
+            img.close()
+        return {"page_no": page_no, "stamp": stamp, "page_hash": page_hash,
+                "spooled": spool_page(file_hash, page_no, encoded)}
+    except Exception as e:
+        fail_upload(db_session, db_session.get(UploadMetadata, upload_id), file_hash, e)
+        logger.error(f"❌ Page {page_no} of {original_filename} failed: {e}")
+        raise DocumentProcessingError(str(e))
+    finally:
+        db_session.close()
+
+
+@app.task(bind=True, name="ocr_page")
+def ocr_page_task(self, prepared, file_hash, upload_id, progress_id=None, page_total=None):
+    """Network stage of a page: the vision model cascade on a spooled image"""
+    page_no = prepared["page_no"]
+    if "record" in prepared:
+        # Checkpointed pages were already counted by the "started" event
+        if not prepared.get("resumed"):
+            progress_events.publish_page(progress_id, page_no, page_total,
+                                         tier=prepared["record"].get("Extraction_Tier"))
+        return prepared["record"]
+
+    db_session = SessionLocal()
+    try:
+        ocr_started = time.monotonic()
+        encoded = load_spooled(prepared["spooled"])
+        accepted = run_model_cascade(encoded, page_no, prepared["stamp"])
+        record = fix_missing_fields(normalize_record(_store_cascade_result(accepted, prepared["page_hash"])))
+        checkpoint_page(db_session, upload_id, page_no, record)
+        release_spooled(prepared["spooled"])
+        progress_events.publish_page(progress_id, page_no, page_total, tier=record.get("Extraction_Tier"),
+                                     ocr_ms=elapsed_ms(ocr_started))
+        return record
+    except TRANSIENT_OCR_ERRORS as e:
+        retry_page_task(self, db_session, upload_id, file_hash, page_no, e, progress_id)  # the spooled page is kept
+    except Exception as e:
+        release_spooled(prepared["spooled"])
+        fail_upload(db_session, db_session.get(UploadMetadata, upload_id), file_hash, e)
+        progress_events.publish(progress_id, {"type": "failed", "page": page_no, "error": str(e)})
+        logger.error(f"❌ OCR of page {page_no} failed: {e}")
+        raise DocumentProcessingError(str(e))
+    finally:
+        db_session.close()
+
+
+def retry_page_task(task, db_session, upload_id, file_hash, page_no, error, progress_id=None):
+    """Retry a page task with exponential countdown up to the upload's max_retries, then fail the upload"""
+    db_session.rollback()
+    max_retries = db_session.get(UploadMetadata, upload_id).max_retries
+    if task.request.retries < max_retries:
+        countdown = OCR_TASK_RETRY_DELAY * 2 ** task.request.retries
+        logger.warning(f"🔁 Page {page_no}: {type(error).__name__}, retry in {countdown}s")
+        progress_events.publish(progress_id, {"type": "retrying", "page": page_no,
+                                              "attempt": task.request.retries + 1, "countdown": countdown})
+        raise task.retry(exc=error, countdown=countdown, max_retries=max_retries)
+    fail_upload(db_session, db_session.get(UploadMetadata, upload_id), file_hash, error)
+    progress_events.publish(progress_id, {"type": "failed", "page": page_no, "error": str(error)})
+    raise DocumentProcessingError(str(error))
+
+
+@app.task(bind=True, name="finalize_document")
+def finalize_document_task(self, records, original_filename, file_hash, upload_id):
+    # replace() gave this callback the original process_document task id
+    db_session = SessionLocal()
+    upload_metadata = None
+    try:
+        upload_metadata = db_session.get(UploadMetadata, upload_id)
+        # Another run of the same file may have finished while pages were in flight
+        if save_records(db_session, records, upload_metadata) is None:
+            return skip_duplicate(file_hash, original_filename, self.request.id)
+        finish_upload(file_hash, completed=True)
+        queue_embeddings(upload_id)
         logger.info(f"✅ All records for {original_filename} processed successfully.")
-        return {"status": "SUCCESS", "records_processed": len(records)}
+        result = {"status": "SUCCESS", "records_processed": len(records), "ocr_usage": summarize_page_stats(records)}
+        progress_events.publish(self.request.id, {"type": "complete", "current": len(records),
+                                                  "total": len(records), **result})
+        return result
 
     except Exception as e:
-        db_session.rollback()
-        logger.error(f"❌ Document processing failed: {e}")
+        fail_upload(db_session, upload_metadata, file_hash, e)
+        progress_events.publish(self.request.id, {"type": "failed", "error": str(e)})
         raise DocumentProcessingError(str(e))
     finally:
         db_session.close()
+
+
+@app.task(name="replay_extractions")
+def replay_extractions_task(dry_run=False, upload_ids=None):
+    db_session = SessionLocal()
+    try:
+        return replay_extractions(db_session, dry_run=dry_run, upload_ids=upload_ids)
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+@app.task(bind=True, name="generate_embeddings")
+def generate_embeddings_task(self, upload_ids=None, force=False):
+    """Batched, incremental embedding of ExtractedDocs; retries resume from the last committed chunk"""
+    db_session = SessionLocal()
+
+    def on_progress(scanned, total, stats):
+        self.update_state(state='PROGRESS', meta={"progress": {"current": scanned, "total": total}, **stats})
+        progress_events.publish(self.request.id, {"type": "progress", "current": scanned, "total": total, **stats})
+
+    try:
+        stats = generate_embeddings(db_session, client, upload_ids=upload_ids, force=force, on_progress=on_progress)
+        result = {"status": "SUCCESS", **stats}
+        progress_events.publish(self.request.id, {"type": "complete", **result})
+        return result
+    except TRANSIENT_OCR_ERRORS as e:
+        db_session.rollback()
+        countdown = OCR_TASK_RETRY_DELAY * 2 ** self.request.retries
+        logger.warning(f"🔁 Embeddings: {type(e).__name__}, retry in {countdown}s")
+        raise self.retry(exc=e, countdown=countdown, max_retries=EMBEDDING_TASK_MAX_RETRIES)
+    except Exception as e:
+        db_session.rollback()
+        progress_events.publish(self.request.id, {"type": "failed", "error": str(e)})
+        raise
+    finally:
+        db_session.close()
@@ -0,0 +1,96 @@
+import os, logging
+import redis
+from celery_app import BROKER_URL
+from redis_client import get_redis as _get_redis
+
+logger = logging.getLogger(__name__)
+
+# Edge-side duplicate detection: a Redis bloom filter for the cheap "never seen" answer,
+# backed by an exact set of completed file hashes, plus an in-flight lock per hash.
+DEDUP_REDIS_URL = os.environ.get("DEDUP_REDIS_URL", BROKER_URL)
+BLOOM_BITS = int(os.environ.get("DEDUP_BLOOM_BITS", str(1 << 24)))
+BLOOM_HASHES = 7
+INFLIGHT_TTL = int(os.environ.get("DEDUP_INFLIGHT_TTL", "3600"))
+
+BLOOM_KEY = "uploads:bloom"
+KNOWN_KEY = "uploads:known"
+SEEDED_KEY = "uploads:seeded"
+INFLIGHT_PREFIX = "uploads:inflight:"
+
+# UploadMetadata statuses of uploads the worker has not finished; they are not duplicates
+UNFINISHED_STATUSES = ("Processing", "Retrying", "Failed")
+
+
+def get_redis():
+    return _get_redis(DEDUP_REDIS_URL)
+
+
+def _bloom_offsets(file_hash):
+    # The SHA-256 hex digest is already uniformly distributed; slice it into k indexes
+    return [int(file_hash[i * 8:(i + 1) * 8], 16) % BLOOM_BITS for i in range(BLOOM_HASHES)]
+
+
+def mark_known(file_hash):
+    pipe = get_redis().pipeline()
+    for offset in _bloom_offsets(file_hash):
+        pipe.setbit(BLOOM_KEY, offset, 1)
+    pipe.sadd(KNOWN_KEY, file_hash)
+    pipe.execute()
+
+
+def is_known(file_hash):
+    r = get_redis()
+    pipe = r.pipeline()
+    for offset in _bloom_offsets(file_hash):
+        pipe.getbit(BLOOM_KEY, offset)
+    if not all(pipe.execute()):
+        return False
+    return bool(r.sismember(KNOWN_KEY, file_hash))
+
+
+def seed_known_hashes(db_session):
+    """Load existing UploadMetadata hashes into Redis once (first caller wins)"""
+    from models import UploadMetadata
+
+    r = get_redis()
+    if not r.set(SEEDED_KEY, 1, nx=True):
+        return 0
+    seeded = 0
+    query = db_session.query(UploadMetadata.file_hash).filter(
+        UploadMetadata.file_hash.isnot(None), UploadMetadata.upload_status.notin_(UNFINISHED_STATUSES)
+    )
+    for (file_hash,) in query.yield_per(1000):
+        mark_known(file_hash)
+        seeded += 1
+    logger.info(f"🌱 Seeded {seeded} known upload hashes")
+    return seeded
+
+
+def claim_inflight(file_hash, task_id):
+    """
+    Take the in-flight lock for a file hash.
+    Returns None if this caller owns it, otherwise the task id already processing the file.
+    """
+    r = get_redis()
+    key = INFLIGHT_PREFIX + file_hash
+    for _ in range(3):
+        if r.set(key, task_id, nx=True, ex=INFLIGHT_TTL):
+            return None
+        existing = r.get(key)
+        if existing:
+            return existing
+    return None
+
+
+def release_inflight(file_hash):
+    get_redis().delete(INFLIGHT_PREFIX + file_hash)
+
+
+def settle_upload(file_hash, completed):
+    """Worker-side bookkeeping once an upload is done (or failed); never raises"""
+    try:
+        if completed:
+            mark_known(file_hash)
+        release_inflight(file_hash)
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Could not update dedup state for {file_hash}: {e}")
@@ -0,0 +1,37 @@
+// pages/api/events.js
+
+import axios from 'axios';
+
+const PYTHON_API_URL = process.env.PYTHON_API_URL || 'http://localhost:5000';
+const CELERY_EVENTS_BASE_URL = `${PYTHON_API_URL}/api/tasks/events`;
+
+// Server-Sent Events are streamed through unchanged, so the body parser and response buffering stay off
+export const config = {
+  api: { bodyParser: false, responseLimit: false },
+};
+
+export default async function handler(req, res) {
+  const { taskId } = req.query;
+
+  if (!taskId) {
+    return res.status(400).json({ message: 'Task ID is required.' });
+  }
+
+  try {
+    const upstream = await axios.get(`${CELERY_EVENTS_BASE_URL}/${taskId}`, { responseType: 'stream' });
+
+    res.writeHead(200, {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache, no-transform',
+      'Connection': 'keep-alive',
+      'X-Accel-Buffering': 'no',
+    });
+    upstream.data.pipe(res);
+
+    // Stop reading from Python as soon as the browser goes away
+    req.on('close', () => upstream.data.destroy());
+  } catch (error) {
+    console.error(`Error streaming events for task ${taskId}:`, error.message);
+    return res.status(error.response?.status || 500).json({ message: 'Failed to stream task events.', details: error.message });
+  }
+}
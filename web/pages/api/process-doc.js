@@ -41,9 +41,12 @@ const handler = async (req, res) => {
     const fileBase64 = fileBuffer.toString('base64');
 
     // Send the task to Python API
+    // The login token identifies the uploader; the backend derives the fair-share tenant from it
     const celeryResponse = await axios.post(CELERY_SUBMIT_URL, {
       file_content_b64: fileBase64,
       original_filename: file.originalFilename,
+    }, {
+      headers: req.headers.authorization ? { Authorization: req.headers.authorization } : {},
     });
 
     // Clean up temp file
@@ -51,9 +54,21 @@ const handler = async (req, res) => {
       console.error('Failed to clean up temp file:', e)
     );
 
+    // Re-sent files are recognised by the backend and not processed again
+    if (celeryResponse.data.status === 'Duplicate') {
+      return res.status(200).json({
+        message: 'This file has already been processed.',
+        status: 'Duplicate',
+        taskId: null,
+      });
+    }
+
     // Return task info
     return res.status(200).json({
-      message: 'Processing started successfully.',
+      message: celeryResponse.data.status === 'Deferred'
+        ? 'Queued; processing starts when capacity frees up.'
+        : 'Processing started successfully.',
+      status: celeryResponse.data.status,
       taskId: celeryResponse.data.taskId || celeryResponse.data.task_id,
     });
   } catch (error) {
@@ -63,6 +78,17 @@ const handler = async (req, res) => {
       await fs.unlink(file.filepath).catch(() => {});
     }
 
+    // Admission control: the backend is at capacity and says when to come back
+    if (error.response?.status === 429) {
+      const retryAfter = error.response.headers['retry-after'];
+      if (retryAfter) res.setHeader('Retry-After', retryAfter);
+      return res.status(429).json({
+        message: 'Server is busy.',
+        detail: error.response.data?.detail || 'Processing queue is full, please retry later.',
+        retryAfter: Number(retryAfter) || null,
+      });
+    }
+
     return res.status(500).json({
       message: 'Failed to start processing.',
       error: error.message,
@@ -29,6 +29,7 @@ export default function LoginPage() {
       sessionStorage.setItem("userName", data.name);
       sessionStorage.setItem("userType", data.user_type);
       sessionStorage.setItem("companyName", data.company_name);
+      sessionStorage.setItem("authToken", data.token);
 
       setMessage("✨ Login successful! Redirecting...");
 
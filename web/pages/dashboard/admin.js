@@ -168,22 +168,95 @@ export default function Home() {
       formData.append("document", file);
 
       try {
-          const res = await fetch("/api/process-doc", { method: "POST", body: formData });
+          // The backend attributes the upload to the logged-in user's company for fair scheduling
+          const token = sessionStorage.getItem("authToken");
+          const res = await fetch("/api/process-doc", {
+            method: "POST",
+            body: formData,
+            headers: token ? { Authorization: `Bearer ${token}` } : {},
+          });
           const data = await res.json();
 
           if (!res.ok) {
               throw new Error(data.detail || `Upload failed: ${res.statusText}`);
           }
 
+          if (data.status === "Duplicate") {
+              setStatus("SUCCESS");
+              setMessage("ℹ️ This file has already been processed.");
+              return;
+          }
+
           setTaskId(data.taskId);
           setStatus("PROCESSING");
-          pollStatus(data.taskId);
+          watchProgress(data.taskId);
       } catch (error) {
           setMessage(`❌ Upload failed: ${error.message}`);
           setStatus("FAILURE");
       }
     };
 
+    const finishProcessing = (succeeded, error) => {
+      if (succeeded) {
+        setStatus("SUCCESS");
+        setMessage("✅ Processing Complete. Refreshing data from database...");
+        setProgress(100);
+        fetchData(true); // Mark new records
+      } else {
+        setStatus("FAILURE");
+        setMessage(`❌ Processing Failed: ${error || 'Unknown error'}`);
+      }
+    };
+
+    // Live progress over Server-Sent Events; falls back to polling if the stream can't be used
+    const watchProgress = (id) => {
+      if (typeof EventSource === "undefined") {
+        pollStatus(id);
+        return;
+      }
+
+      const source = new EventSource(`/api/events?taskId=${id}`);
+      let done = false;
+
+      source.addEventListener("started", (e) => {
+        const data = JSON.parse(e.data);
+        setProgress(data.total ? Math.round((data.current / data.total) * 100) : 0);
+        setMessage(data.resumed ? `Resuming: ${data.resumed} of ${data.total} pages already done...` : "Extraction in progress...");
+      });
+      source.addEventListener("page", (e) => {
+        const { current, total } = JSON.parse(e.data);
+        if (current && total) {
+          setProgress(Math.round((current / total) * 100));
+          setMessage(`Processing page ${current} of ${total}...`);
+        }
+      });
+      source.addEventListener("retrying", (e) => {
+        const { countdown } = JSON.parse(e.data);
+        setMessage(`Temporary OCR error, retrying in ${countdown}s...`);
+      });
+      source.addEventListener("complete", (e) => {
+        done = true;
+        source.close();
+        if (JSON.parse(e.data).status === "SKIPPED") {
+          setStatus("SUCCESS");
+          setProgress(100);
+          setMessage("ℹ️ This file has already been processed.");
+          return;
+        }
+        finishProcessing(true);
+      });
+      source.addEventListener("failed", (e) => {
+        done = true;
+        source.close();
+        finishProcessing(false, JSON.parse(e.data).error);
+      });
+      source.onerror = () => {
+        // The server closes the stream after a terminal event; anything else means SSE is unavailable
+        source.close();
+        if (!done) pollStatus(id);
+      };
+    };
+
     const pollStatus = (id) => {
       const interval = setInterval(async () => {
         try {
@@ -192,15 +265,7 @@ export default function Home() {
 
             if (data.status === "SUCCESS" || data.status === "FAILURE") {
               clearInterval(interval);
-              setStatus(data.status);
-
-              if (data.status === "SUCCESS") {
-                setMessage("✅ Processing Complete. Refreshing data from database...");
-                setProgress(100);
-                fetchData(true); // Mark new records
-              } else {
-                setMessage(`❌ Processing Failed: ${data.result?.error || 'Unknown error'}`);
-              }
+              finishProcessing(data.status === "SUCCESS", data.error || data.result?.error);
               return;
             }
 
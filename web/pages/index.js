@@ -165,13 +165,25 @@ export default function Home() {
       formData.append("document", file);
 
       try {
-          const res = await fetch("/api/process-doc", { method: "POST", body: formData });
+          // The backend attributes the upload to the logged-in user's company for fair scheduling
+          const token = sessionStorage.getItem("authToken");
+          const res = await fetch("/api/process-doc", {
+            method: "POST",
+            body: formData,
+            headers: token ? { Authorization: `Bearer ${token}` } : {},
+          });
           const data = await res.json();
 
           if (!res.ok) {
               throw new Error(data.detail || `Upload failed: ${res.statusText}`);
           }
 
+          if (data.status === "Duplicate") {
+              setStatus("SUCCESS");
+              setMessage("ℹ️ This file has already been processed.");
+              return;
+          }
+
           setTaskId(data.taskId);
           setStatus("PROCESSING");
           pollStatus(data.taskId);